@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Local HTTP/JSON API for NET Guard application.
+
+Serves the scanner state to dashboards and scripts on the local machine:
+
+GET /online              devices online in the last complete scan cycle; ?since=<version> returns only the changes
+GET /devices             registered devices; ?since=<version> returns only the changes, archived MACs in "removed"
+GET /devices/<mac>       details, IP bindings and uptime of a device
+GET /stats               scan cycle statistics
+GET /events?since=<v>    detection events newer than v; &wait=<seconds> long-polls for them
+GET /stream              the same events as server-sent events
+
+When it runs next to a collector (see collector.py) it also serves the merged registry of all sites:
+
+GET /sites                          sites known by the collector
+GET /sites/<site>/devices           registered devices of a site; ?since=<version> returns only the changes, removed MACs in "removed"
+GET /sites/<site>/online            devices online in the last scan cycle of a site
+
+State responses carry the journal version as ETag, so pollers can use If-None-Match. Events have versions of their own.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from journal import CHANGE_DEVICE, CHANGE_ONLINE
+from scanner import (DEVICE_INFO_FIRST_DETECTED, DEVICE_INFO_LAST_DETECTED,
+                     DEVICE_INFO_NAME, DEVICE_INFO_TRUST_LEVEL)
+
+MAX_WAIT = 60
+WEEK = 7*86400
+
+
+def deviceToDict(mac, info):
+	return {
+		"mac": mac,
+		"name": info[DEVICE_INFO_NAME],
+		"trustLevel": info[DEVICE_INFO_TRUST_LEVEL],
+		"firstDetected": info[DEVICE_INFO_FIRST_DETECTED],
+		"lastDetected": info[DEVICE_INFO_LAST_DETECTED]
+	}
+
+
+class APIServer(Thread):
+	def __init__(self, scanner, port=8765, host="127.0.0.1", collector=None):
+		Thread.__init__(self)
+		self.name = "API server"
+		self.setDaemon(True)
+		self.scanner = scanner
+		self.collector = collector
+		self.httpd = ThreadingHTTPServer((host, port), APIRequestHandler)
+		self.httpd.daemon_threads = True
+		self.httpd.api = self
+		# path -> (version, body); many pollers share one serialisation per version
+		self.__cache = {}
+		self.__cacheLock = Lock()
+
+	def run(self):
+		self.httpd.serve_forever()
+
+	def kill(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def cached(self, path, version, build):
+		with self.__cacheLock:
+			entry = self.__cache.get(path)
+			if entry and entry[0] == version:
+				return entry[1]
+		body = json.dumps(build()).encode()
+		with self.__cacheLock:
+			self.__cache[path] = (version, body)
+		return body
+
+	def online(self):
+		devices = self.scanner.devices
+		online = []
+		for ip, mac in self.scanner.online:
+			info = devices.get(mac)
+			online.append({
+				"ip": ip,
+				"mac": mac,
+				"name": info[DEVICE_INFO_NAME] if info else "",
+				"trustLevel": info[DEVICE_INFO_TRUST_LEVEL] if info else None
+			})
+		return online
+
+	def devices(self, macs=None):
+		devices = self.scanner.devices
+		with self.scanner.lock:
+			if macs is None:
+				return {mac: deviceToDict(mac, info) for mac, info in devices.items()}
+			return {mac: deviceToDict(mac, devices[mac]) for mac in macs if mac in devices}
+
+	def siteDevices(self, site, keys=None):
+		devices = self.collector.devices
+		with self.collector.lock:
+			if keys is None:
+				keys = [key for key in devices if key[0] == site]
+			return {key[1]: deviceToDict(key[1], devices[key]) for key in keys if key[0] == site and key in devices}
+
+	def device(self, mac):
+		devices = self.scanner.devices
+		with self.scanner.lock:
+			info = devices.get(mac)
+			if not info: return None
+			device = deviceToDict(mac, info)
+			device["ip"] = self.scanner.bindings.ipOf(mac)
+			device["ipHistory"] = self.scanner.bindings.ipsForMac(mac)
+			now = time()
+			device["uptimeWeek"] = self.scanner.presence.uptime(mac, now-WEEK, now)
+		return device
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+	server_version = "NETGuard"
+
+	def do_GET(self):
+		api = self.server.api
+		url = urlsplit(self.path)
+		query = parse_qs(url.query)
+		path = url.path.rstrip("/")
+		try:
+			since = int(query["since"][0]) if "since" in query else None
+			wait = min(float(query["wait"][0]), MAX_WAIT) if "wait" in query else 0
+		except ValueError:
+			return self.sendJSON(400, {"error": "Invalid parameter"})
+		if api.collector and (path == "/sites" or path.startswith("/sites/")):
+			return self.getSites(path, since)
+		if not api.scanner:
+			return self.sendJSON(404, {"error": "Not found"})
+		journal = api.scanner.journal
+		version = journal.version
+		if path == "/stream":
+			return self.stream(since if since is not None else journal.eventVersion)
+		if path == "/events":
+			if since is None: since = journal.eventVersion
+			events = journal.waitEvents(since, wait) if wait else journal.eventsSince(since)
+			return self.sendJSON(200, {"version": journal.eventVersion, "events": events})
+		if path == "/stats":
+			# Statistics change without a journal version, so they carry no ETag
+			return self.sendJSON(200, dict(api.scanner.stats, version=version))
+		if self.headers.get("If-None-Match") == '"{}"'.format(version):
+			return self.sendJSON(304, None, version)
+		if path == "/online":
+			if since is not None:
+				changed = journal.changesSince(since, CHANGE_ONLINE)
+				if changed is not None:
+					changed = set(changed)
+					online = [d for d in api.online() if d["ip"] in changed]
+					removed = sorted(changed.difference(d["ip"] for d in online))
+					return self.sendJSON(200, {"version": version, "since": since, "online": online, "removed": removed}, version)
+			body = api.cached(path, version, lambda: {"version": version, "online": api.online()})
+			return self.sendBody(200, body, version)
+		if path == "/devices":
+			if since is not None:
+				changed = journal.changesSince(since, CHANGE_DEVICE)
+				if changed is not None:
+					devices = api.devices(changed)
+					# Archived devices leave the registry
+					removed = sorted(set(changed).difference(devices))
+					return self.sendJSON(200, {"version": version, "since": since, "devices": devices, "removed": removed}, version)
+			body = api.cached(path, version, lambda: {"version": version, "devices": api.devices()})
+			return self.sendBody(200, body, version)
+		if path.startswith("/devices/"):
+			device = api.device(unquote(path[len("/devices/"):]))
+			if not device:
+				return self.sendJSON(404, {"error": "Unknown device"})
+			return self.sendJSON(200, device, version)
+		self.sendJSON(404, {"error": "Not found"})
+
+	def getSites(self, path, since):
+		api = self.server.api
+		journal = api.collector.journal
+		version = journal.version
+		if self.headers.get("If-None-Match") == '"{}"'.format(version):
+			return self.sendJSON(304, None, version)
+		if path == "/sites":
+			return self.sendJSON(200, {"version": version, "sites": api.collector.sites}, version)
+		parts = path.split("/")
+		site = unquote(parts[2]) if len(parts) == 4 else None
+		if site not in api.collector.sites:
+			return self.sendJSON(404, {"error": "Not found"})
+		if parts[3] == "online":
+			return self.sendJSON(200, {"version": version, "online": api.collector.online(site)}, version)
+		if parts[3] == "devices":
+			if since is not None:
+				changed = journal.changesSince(since, CHANGE_DEVICE)
+				if changed is not None:
+					devices = api.siteDevices(site, changed)
+					removed = sorted(set(key[1] for key in changed if key[0] == site).difference(devices))
+					return self.sendJSON(200, {"version": version, "since": since, "devices": devices, "removed": removed}, version)
+			body = api.cached(path, version, lambda: {"version": version, "devices": api.siteDevices(site)})
+			return self.sendBody(200, body, version)
+		self.sendJSON(404, {"error": "Not found"})
+
+	def stream(self, since):
+		journal = self.server.api.scanner.journal
+		self.send_response(200)
+		self.send_header("Content-Type", "text/event-stream")
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+		try:
+			while not self.server.api.scanner.flagStop:
+				events = journal.waitEvents(since, MAX_WAIT)
+				for event in events:
+					self.wfile.write("id: {version}\nevent: {type}\ndata: {data}\n\n".format(
+						version=event["version"],
+						type=event["type"],
+						data=json.dumps(event)
+					).encode())
+					since = event["version"]
+				if not events:
+					# Keeps the connection alive and detects closed clients
+					self.wfile.write(b": ping\n\n")
+				self.wfile.flush()
+		except (BrokenPipeError, ConnectionResetError):
+			pass
+
+	def sendJSON(self, code, data, version=None):
+		self.sendBody(code, json.dumps(data).encode() if data is not None else b"", version)
+
+	def sendBody(self, code, body, version=None):
+		self.send_response(code)
+		if version is not None:
+			self.send_header("ETag", '"{}"'.format(version))
+		if body:
+			self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
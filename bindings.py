@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+IP-MAC binding index for NET Guard application.
+
+Keeps track of which IP addresses each MAC address has used and which MAC addresses have claimed each IP address.
+Every observation is checked in constant time for IP conflicts, MAC flapping and gateway MAC changes.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+from collections import deque
+
+BINDING_FIRST_SEEN = 0
+BINDING_LAST_SEEN = 1
+
+ALERT_IP_CONFLICT = "ipConflict"
+ALERT_MAC_FLAPPING = "macFlapping"
+ALERT_GATEWAY_CHANGED = "gatewayChanged"
+
+
+class BindingIndex:
+	"""Bidirectional IP<->MAC index with a bounded binding history per key."""
+
+	def __init__(self, gateway=None, history=16, flapCount=3, flapWindow=3600, conflictWindow=3600):
+		self.gateway = gateway
+		# An IP is still held by its owner if the owner answered from it less than conflictWindow seconds ago
+		self.conflictWindow = conflictWindow
+		self.__history = history
+		self.__flapCount = flapCount
+		self.__flapWindow = flapWindow
+		# ip -> {mac: [first, last]} and mac -> {ip: [first, last]}, oldest binding first
+		self.__ipToMacs = {}
+		self.__macToIps = {}
+		# Current holder of each IP and current IP of each MAC
+		self.__ipOwner = {}
+		self.__macAddress = {}
+		# IPs claimed during the running scan cycle
+		self.__cycleClaims = {}
+		# Timestamps of the latest IP changes of each MAC
+		self.__macChanges = {}
+		self.__gatewayMac = None
+
+	def newCycle(self):
+		self.__cycleClaims.clear()
+
+	def observe(self, ip, mac, timestamp):
+		"""Records that ip answered with mac and returns a list of (alert, details) tuples."""
+		alerts = []
+		claimant = self.__cycleClaims.get(ip)
+		owner = self.__ipOwner.get(ip)
+		if claimant and claimant != mac:
+			alerts.append((ALERT_IP_CONFLICT, {"ip": ip, "macs": [claimant, mac]}))
+		elif owner and owner != mac and self.__macAddress.get(owner) == ip \
+			and timestamp - self.__macToIps[owner][ip][BINDING_LAST_SEEN] <= self.conflictWindow:
+			# Each IP is probed once per cycle, so most conflicts show up as a new MAC for an IP whose owner has not moved
+			alerts.append((ALERT_IP_CONFLICT, {"ip": ip, "macs": [owner, mac]}))
+		self.__cycleClaims[ip] = mac
+		previousIp = self.__macAddress.get(mac)
+		if previousIp and previousIp != ip:
+			changes = self.__macChanges.get(mac)
+			if changes is None:
+				changes = self.__macChanges[mac] = deque(maxlen=self.__flapCount)
+			changes.append(timestamp)
+			if len(changes) == self.__flapCount and timestamp - changes[0] <= self.__flapWindow:
+				alerts.append((ALERT_MAC_FLAPPING, {"mac": mac, "ips": [previousIp, ip]}))
+		if ip == self.gateway:
+			if self.__gatewayMac and self.__gatewayMac != mac:
+				alerts.append((ALERT_GATEWAY_CHANGED, {"ip": ip, "old": self.__gatewayMac, "new": mac}))
+			self.__gatewayMac = mac
+		self.__bind(self.__ipToMacs, ip, mac, timestamp)
+		self.__bind(self.__macToIps, mac, ip, timestamp)
+		self.__ipOwner[ip] = mac
+		self.__macAddress[mac] = ip
+		return alerts
+
+	def __bind(self, index, key, value, timestamp):
+		bindings = index.get(key)
+		if bindings is None:
+			bindings = index[key] = {}
+		binding = bindings.pop(value, None)
+		if binding is None:
+			binding = [timestamp, timestamp]
+			if len(bindings) >= self.__history:
+				del bindings[next(iter(bindings))]
+		else:
+			binding[BINDING_LAST_SEEN] = timestamp
+		# Reinserting keeps the most recent binding at the end
+		bindings[value] = binding
+
+	def macsForIp(self, ip):
+		return {mac: tuple(b) for mac, b in self.__ipToMacs.get(ip, {}).items()}
+
+	def ipsForMac(self, mac):
+		return {ip: tuple(b) for ip, b in self.__macToIps.get(mac, {}).items()}
+
+	def ipOf(self, mac):
+		return self.__macAddress.get(mac)
+
+	def macOf(self, ip):
+		return self.__ipOwner.get(ip)
+
+	@property
+	def gatewayMac(self):
+		return self.__gatewayMac
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Multi-site collector for NET Guard application.
+
+Every NET Guard node can send the changes of its device registry to a central collector, which merges them into one registry keyed by (site, MAC).
+The merged view is served by the local API (see api.py).
+
+Frames are a 4 byte big endian length, a flags byte and a JSON payload, zlib compressed when it is worth it.
+Each batch carries a sequence number (node epoch, journal version, part); the collector ignores any batch older than the last one applied for the site, so resending after a reconnection is harmless.
+Devices archived by a node are sent as null. A full batch, sent after a reconnection the collector cannot follow, replaces all the devices of the site.
+Memory is bounded: a site keeps at most maxDevicesPerSite devices, and sites silent for siteExpiry seconds are forgotten.
+
+Run a headless collector with:
+	py collector.py --listen 0.0.0.0:8766 --api 8765
+and feed it with simulated nodes with:
+	py collector.py --simulate 5 --connect 127.0.0.1:8766 [--site-prefix office]
+Several simulator processes can feed the same collector; the site names include the process id unless --site-prefix is given.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+import json
+import os
+import selectors
+import socket
+import struct
+import sys
+import zlib
+from threading import Event, Lock, Thread
+from time import sleep, time
+
+from journal import CHANGE_DEVICE, EVENT_SCAN_CYCLE_FINISH, ChangeJournal
+
+FRAME_HEADER = struct.Struct(">IB")
+FLAG_COMPRESSED = 1
+MAX_FRAME = 4*1024*1024
+COMPRESS_THRESHOLD = 1024
+DAY = 86400
+UNIX_PREFIX = "unix:"
+
+
+def encodeFrame(message):
+	payload = json.dumps(message, separators=(",", ":")).encode()
+	flags = 0
+	if len(payload) > COMPRESS_THRESHOLD:
+		payload = zlib.compress(payload)
+		flags |= FLAG_COMPRESSED
+	return FRAME_HEADER.pack(len(payload), flags) + payload
+
+def decodeFrame(flags, payload):
+	if flags & FLAG_COMPRESSED:
+		payload = zlib.decompress(payload)
+	return json.loads(payload)
+
+def readFrame(sock):
+	header = recvExactly(sock, FRAME_HEADER.size)
+	length, flags = FRAME_HEADER.unpack(header)
+	if length > MAX_FRAME: raise ValueError("Frame too large")
+	return decodeFrame(flags, recvExactly(sock, length))
+
+def readAck(sock):
+	ack = readFrame(sock)
+	if not isinstance(ack, dict) or ack.get("type") != "ack" or not isinstance(ack.get("seq"), list):
+		raise ValueError("Malformed ack")
+	return ack
+
+def recvExactly(sock, n):
+	data = b""
+	while len(data) < n:
+		chunk = sock.recv(n-len(data))
+		if not chunk: raise ConnectionError("Connection closed")
+		data += chunk
+	return data
+
+def createSocket(address, listen=False):
+	"""Opens a socket for "host:port" or "unix:/path" addresses."""
+	if address.startswith(UNIX_PREFIX):
+		path = address[len(UNIX_PREFIX):]
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		if listen:
+			if os.path.exists(path): os.remove(path)
+			sock.bind(path)
+		else:
+			sock.connect(path)
+	else:
+		host, port = address.rsplit(":", 1)
+		if listen:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			sock.bind((host, int(port)))
+		else:
+			sock = socket.create_connection((host, int(port)))
+	if listen: sock.listen(128)
+	return sock
+
+
+class Collector(Thread):
+	def __init__(self, address, maxConnections=1024, maxDevicesPerSite=100000, siteExpiry=30*DAY):
+		Thread.__init__(self)
+		self.name = "Collector"
+		self.setDaemon(True)
+		self.flagStop = False
+		self.lock = Lock()
+		self.maxConnections = maxConnections
+		self.maxDevicesPerSite = maxDevicesPerSite
+		self.siteExpiry = siteExpiry
+		self.__lastExpiry = time()
+		self.__listener = createSocket(address, listen=True)
+		self.__listener.setblocking(False)
+		self.__selector = selectors.DefaultSelector()
+		self.__selector.register(self.__listener, selectors.EVENT_READ)
+		# socket -> bytearray with the incomplete frame received so far
+		self.__buffers = {}
+		# socket -> bytearray with the acks not sent yet
+		self.__outputs = {}
+		# (site, mac) -> device info tuple, as in LANScanner.devices
+		self.__devices = {}
+		# site -> {"seq", "online", "lastBatch", "lastSeen", "connected", "devices", "dropped"}
+		self.__sites = {}
+		self.__journal = ChangeJournal()
+
+	def run(self):
+		while not self.flagStop:
+			for key, mask in self.__selector.select(timeout=1.0):
+				if key.fileobj is self.__listener:
+					self.accept()
+					continue
+				if mask & selectors.EVENT_WRITE:
+					self.flush(key.fileobj)
+				if mask & selectors.EVENT_READ and key.fileobj in self.__buffers:
+					self.receive(key.fileobj)
+			if time()-self.__lastExpiry >= 60:
+				self.expire()
+		for sock in list(self.__buffers):
+			self.disconnect(sock)
+		self.__listener.close()
+
+	def accept(self):
+		try:
+			sock, address = self.__listener.accept()
+		except OSError:
+			return
+		if len(self.__buffers) >= self.maxConnections:
+			sock.close()
+			return
+		sock.setblocking(False)
+		self.__buffers[sock] = bytearray()
+		self.__outputs[sock] = bytearray()
+		self.__selector.register(sock, selectors.EVENT_READ, data=None)
+
+	def disconnect(self, sock):
+		self.__selector.unregister(sock)
+		del self.__buffers[sock]
+		del self.__outputs[sock]
+		sock.close()
+		with self.lock:
+			for site in self.__sites.values():
+				if site["connected"] is sock: site["connected"] = None
+
+	def receive(self, sock):
+		try:
+			data = sock.recv(65536)
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError:
+			data = b""
+		if not data:
+			self.disconnect(sock)
+			return
+		buffer = self.__buffers[sock]
+		buffer += data
+		try:
+			while len(buffer) >= FRAME_HEADER.size:
+				length, flags = FRAME_HEADER.unpack_from(buffer)
+				if length > MAX_FRAME: raise ValueError("Frame too large")
+				if len(buffer) < FRAME_HEADER.size+length: break
+				message = decodeFrame(flags, bytes(buffer[FRAME_HEADER.size:FRAME_HEADER.size+length]))
+				del buffer[:FRAME_HEADER.size+length]
+				reply = self.handle(sock, message)
+				if reply: self.__outputs[sock] += encodeFrame(reply)
+			self.flush(sock)
+		except (ValueError, KeyError, TypeError, zlib.error, OSError):
+			# Malformed frames or a client that does not read its acks
+			self.disconnect(sock)
+
+	def flush(self, sock):
+		"""Sends as much pending output as the socket takes and waits for EVENT_WRITE for the rest."""
+		output = self.__outputs[sock]
+		try:
+			if output:
+				del output[:sock.send(output)]
+		except (BlockingIOError, InterruptedError):
+			pass
+		except OSError:
+			self.disconnect(sock)
+			return
+		if len(output) > MAX_FRAME:
+			# The client does not read its acks
+			self.disconnect(sock)
+			return
+		events = selectors.EVENT_READ | selectors.EVENT_WRITE if output else selectors.EVENT_READ
+		if self.__selector.get_key(sock).events != events: self.__selector.modify(sock, events)
+
+	def handle(self, sock, message):
+		site = message["site"]
+		with self.lock:
+			state = self.__sites.get(site)
+			if state is None:
+				state = self.__sites[site] = {"seq": [0, 0, 0], "online": [], "lastBatch": None, "lastSeen": None, "connected": None, "devices": 0, "dropped": 0}
+			state["connected"] = sock
+			state["lastSeen"] = time()
+			if message["type"] == "hello":
+				return {"type": "ack", "seq": state["seq"]}
+			seq = message["seq"]
+			if seq <= state["seq"]:
+				# Already applied, acknowledge again
+				return {"type": "ack", "seq": seq}
+			if message.get("full"):
+				# The node sends its whole registry, the devices it leaves out are gone once the last part arrives
+				if seq[2] == 0: state["received"] = set()
+				state.setdefault("received", set()).update(message["devices"])
+			for mac, info in message["devices"].items():
+				key = (site, mac)
+				if info is None:
+					# Tombstone of a device archived by the node
+					if self.__devices.pop(key, None) is not None: state["devices"] -= 1
+				elif key in self.__devices:
+					self.__devices[key] = tuple(info)
+				elif state["devices"] < self.maxDevicesPerSite:
+					self.__devices[key] = tuple(info)
+					state["devices"] += 1
+				else:
+					state["dropped"] += 1
+					continue
+				self.__journal.record(CHANGE_DEVICE, key)
+			# Every part counts, so a replayed earlier part is not applied over a later one
+			state["seq"] = seq
+			if message["last"]:
+				if message.get("full"):
+					received = state.pop("received")
+					self.forget(site, lambda mac: mac not in received)
+				state["online"] = message["online"]
+				state["lastBatch"] = time()
+		return {"type": "ack", "seq": seq}
+
+	def forget(self, site, condition=lambda mac: True):
+		"""Removes the devices of site that meet condition. Called with the lock held."""
+		for key in [key for key in self.__devices if key[0] == site and condition(key[1])]:
+			del self.__devices[key]
+			self.__sites[site]["devices"] -= 1
+			self.__journal.record(CHANGE_DEVICE, key)
+
+	def expire(self, now=None):
+		"""Forgets the sites that have sent nothing for siteExpiry seconds."""
+		now = now or time()
+		self.__lastExpiry = now
+		with self.lock:
+			for site, state in list(self.__sites.items()):
+				if state["connected"] is None and now-(state["lastSeen"] or 0) > self.siteExpiry:
+					self.forget(site)
+					del self.__sites[site]
+
+	def kill(self):
+		self.flagStop = True
+
+	@property
+	def address(self):
+		"""The address the collector listens on, with the actual port if it was 0."""
+		address = self.__listener.getsockname()
+		return UNIX_PREFIX+address if isinstance(address, str) else "{}:{}".format(*address[:2])
+
+	@property
+	def devices(self):
+		return self.__devices
+
+	@property
+	def sites(self):
+		with self.lock:
+			return {site: {
+				"seq": state["seq"],
+				"online": len(state["online"]),
+				"lastBatch": state["lastBatch"],
+				"connected": state["connected"] is not None,
+				"devices": state["devices"],
+				"dropped": state["dropped"]
+			} for site, state in self.__sites.items()}
+
+	def online(self, site):
+		with self.lock:
+			return list(self.__sites[site]["online"]) if site in self.__sites else None
+
+	@property
+	def journal(self):
+		return self.__journal
+
+
+class CollectorClient(Thread):
+	"""Sends the registry changes of a LANScanner to a collector after every scan cycle."""
+
+	def __init__(self, scanner, address, site, batchSize=2000, retry=30):
+		Thread.__init__(self)
+		self.name = "Collector client"
+		self.setDaemon(True)
+		self.scanner = scanner
+		self.address = address
+		self.site = site
+		self.batchSize = batchSize
+		self.retry = retry
+		self.__epoch = int(time())
+		self.__acked = None
+		self.__pending = Event()
+		self.__flagStop = False
+		self.__socket = None
+		scanner.journal.subscribe(self.onEvent)
+
+	def onEvent(self, event):
+		if event["type"] == EVENT_SCAN_CYCLE_FINISH:
+			self.__pending.set()
+
+	def run(self):
+		while not self.__flagStop:
+			self.__pending.wait()
+			self.__pending.clear()
+			try:
+				self.send()
+			except (OSError, ValueError, KeyError, TypeError):
+				# Includes malformed acks, the connection is opened again
+				self.__pending.set()
+				if self.__socket: self.__socket.close()
+				self.__socket = None
+				sleep(self.retry)
+
+	def send(self):
+		if not self.__socket:
+			self.__socket = createSocket(self.address)
+			self.__socket.settimeout(30)
+			self.__socket.sendall(encodeFrame({"type": "hello", "site": self.site}))
+			ack = readAck(self.__socket)
+			if ack["seq"][:2] != [self.__epoch, self.__acked]:
+				# The collector does not have our last batch (it restarted or lost it)
+				self.__acked = None
+		devices = self.scanner.devices
+		online = self.scanner.arp
+		with self.scanner.lock:
+			version = self.scanner.journal.version
+			macs = self.scanner.journal.changesSince(self.__acked, CHANGE_DEVICE) if self.__acked is not None else None
+			full = macs is None
+			if full:
+				# First batch of this run or the journal has forgotten too much: send everything
+				macs = list(devices)
+			# None tells the collector that the device was archived
+			records = [(mac, list(devices[mac]) if mac in devices else None) for mac in macs]
+		parts = range(0, len(records), self.batchSize) if records else [0]
+		for part, start in enumerate(parts):
+			last = start+self.batchSize >= len(records)
+			message = {
+				"type": "batch",
+				"site": self.site,
+				"seq": [self.__epoch, version, part],
+				"devices": dict(records[start:start+self.batchSize]),
+				"full": full,
+				"last": last,
+				"online": online if last else []
+			}
+			self.__socket.sendall(encodeFrame(message))
+			if readAck(self.__socket)["seq"] != message["seq"]: raise ValueError("Unexpected ack")
+		self.__acked = version
+
+	def kill(self):
+		self.__flagStop = True
+		self.__pending.set()
+
+
+def simulate(address, nodes, devicesPerNode=50, cycle=5.0, sitePrefix=None):
+	"""Runs several scanner nodes on simulated networks that feed the collector at address."""
+	from scanner import LANScanner
+	if sitePrefix is None:
+		# Keeps the sites of several simulator processes apart
+		sitePrefix = "sim{}-".format(os.getpid())
+	scanners = []
+	for n in range(nodes):
+		scanner = LANScanner(devices="")
+		CollectorClient(scanner, address, site="{}site{}".format(sitePrefix, n+1), retry=cycle).start()
+		scanners.append(scanner)
+	cycleNumber = 0
+	while True:
+		cycleNumber += 1
+		for n, scanner in enumerate(scanners):
+			scanner.startCycle()
+			with scanner.lock:
+				for d in range(devicesPerNode):
+					# Every cycle a few devices go offline
+					if (d+cycleNumber) % 7:
+						scanner.update("10.{}.0.{}".format(n, d+1), "02:00:00:{:02x}:00:{:02x}".format(n, d))
+			scanner.finishCycle()
+		sleep(cycle)
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	if "--simulate" in args:
+		simulate(
+			args[args.index("--connect")+1],
+			int(args[args.index("--simulate")+1]),
+			sitePrefix=args[args.index("--site-prefix")+1] if "--site-prefix" in args else None
+		)
+	elif "--listen" in args:
+		from api import APIServer
+		collector = Collector(args[args.index("--listen")+1])
+		collector.start()
+		if "--api" in args:
+			APIServer(None, port=int(args[args.index("--api")+1]), collector=collector).start()
+		while collector.is_alive():
+			sleep(1.0)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+NDJSON event log for NET Guard application.
+
+Writes every scanner event as one JSON line to a file or to a Unix socket, so detections can be collected by a log pipeline or SIEM.
+Events are queued and written in batches by a background thread; when the queue is full they are dropped instead of blocking the scan.
+Log files are rotated by size and age, and rotated files can be compressed with gzip.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import socket
+from datetime import datetime
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import time
+
+POLICY_DROP = "drop"
+POLICY_BLOCK = "block"
+
+UNIX_PREFIX = "unix:"
+
+
+class EventLog(Thread):
+	def __init__(self, path, maxBytes=10*1024*1024, maxAge=86400, compress=True, queueSize=10000, batchSize=500, flushInterval=1.0, policy=POLICY_DROP, blockTimeout=0.05):
+		if path.startswith(UNIX_PREFIX) and not hasattr(socket, "AF_UNIX"):
+			raise ValueError("Unix sockets are not supported on this system")
+		Thread.__init__(self)
+		self.name = "Event log"
+		self.setDaemon(True)
+		self.path = path
+		self.maxBytes = maxBytes
+		self.maxAge = maxAge
+		self.compress = compress
+		self.batchSize = batchSize
+		self.flushInterval = flushInterval
+		self.policy = policy
+		self.blockTimeout = blockTimeout
+		self.dropped = 0
+		self.written = 0
+		self.lastError = None
+		self.__queue = Queue(maxsize=queueSize)
+		self.__flagStop = False
+		self.__file = None
+		self.__socket = None
+		self.__opened = 0
+
+	def put(self, event):
+		"""Queues an event. Never blocks longer than blockTimeout, whatever the consumer does."""
+		try:
+			if self.policy == POLICY_BLOCK:
+				self.__queue.put(event, timeout=self.blockTimeout)
+			else:
+				self.__queue.put_nowait(event)
+		except Full:
+			self.dropped += 1
+
+	def run(self):
+		while True:
+			batch = []
+			try:
+				batch.append(self.__queue.get(timeout=self.flushInterval))
+				while len(batch) < self.batchSize:
+					batch.append(self.__queue.get_nowait())
+			except Empty:
+				pass
+			if batch:
+				self.write("".join(json.dumps(event, separators=(",", ":"))+"\n" for event in batch).encode())
+			if self.__flagStop and self.__queue.empty(): break
+		self.close()
+
+	def write(self, data):
+		try:
+			if self.path.startswith(UNIX_PREFIX):
+				if not self.__socket:
+					self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+					self.__socket.connect(self.path[len(UNIX_PREFIX):])
+				self.__socket.sendall(data)
+			else:
+				if self.__file and (self.__file.tell() >= self.maxBytes or time()-self.__opened >= self.maxAge):
+					self.rotate()
+				if not self.__file:
+					self.__file = open(self.path, "ab")
+					self.__opened = time()
+				self.__file.write(data)
+				self.__file.flush()
+			self.written += data.count(b"\n")
+		except OSError as e:
+			# The consumer is gone; the batch is lost and the connection is retried with the next one
+			self.lastError = e
+			self.dropped += data.count(b"\n")
+			self.close()
+
+	def rotate(self):
+		self.__file.close()
+		self.__file = None
+		rotated = "{}.{}".format(self.path, datetime.now().strftime("%Y%m%d-%H%M%S"))
+		n = 0
+		while os.path.exists(rotated+"."+str(n) if n else rotated) or os.path.exists((rotated+"."+str(n) if n else rotated)+".gz"):
+			n += 1
+		if n: rotated += "."+str(n)
+		os.replace(self.path, rotated)
+		if self.compress:
+			with open(rotated, "rb") as src, gzip.open(rotated+".gz", "wb") as dst:
+				shutil.copyfileobj(src, dst)
+			os.remove(rotated)
+
+	def close(self):
+		if self.__file:
+			self.__file.close()
+			self.__file = None
+		if self.__socket:
+			self.__socket.close()
+			self.__socket = None
+
+	def kill(self):
+		"""Stops the writer after the queued events have been written."""
+		self.__flagStop = True
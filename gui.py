@@ -18,15 +18,25 @@ import gettext
 import locale
 import os
 import sys
-import winsound
 from datetime import datetime, timedelta
 from threading import Thread
 
-import pyperclip
 import wx
 import wx.adv
 
+from query import (SORT_FIRST_DETECTED, SORT_IP, SORT_LAST_DETECTED, SORT_MAC,
+                   SORT_NAME, SORT_TRUST_LEVEL, SORT_VENDOR, DeviceIndex,
+                   normalizeMac)
 from scanner import *
+from tracing import traced, tracer
+
+# Sort key of each column of the lists
+ARP_LIST_COLUMNS = (SORT_MAC, SORT_IP, SORT_TRUST_LEVEL, SORT_NAME)
+DEVICES_LIST_COLUMNS = (SORT_MAC, SORT_FIRST_DETECTED, SORT_LAST_DETECTED, SORT_TRUST_LEVEL, SORT_NAME, SORT_VENDOR)
+MAX_SORT_KEYS = 3
+# Milliseconds to gather detections and keystrokes into a single list update
+UPDATE_DELAY = 250
+FILTER_DELAY = 100
 
 
 class SettingsDialog(wx.Dialog):
@@ -172,6 +182,37 @@ class PropertiesDialog(wx.Dialog):
 		evt.Skip()
 
 
+class DeviceList(wx.ListCtrl):
+	"""Virtual list of MACs. Rows are only formatted when they are drawn."""
+
+	def __init__(self, parent, columns, getText):
+		super().__init__(parent, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES | wx.LC_VIRTUAL)
+		for column in columns:
+			self.AppendColumn(column, format=wx.LIST_FORMAT_LEFT, width=160)
+		# getText(mac, column) -> cell text
+		self.getText = getText
+		self.macs = []
+
+	def setMacs(self, macs):
+		self.macs = macs
+		self.SetItemCount(len(macs))
+		self.Refresh()
+
+	def OnGetItemText(self, item, column):
+		if item >= len(self.macs): return ""
+		return self.getText(self.macs[item], column)
+
+	def focusedMac(self):
+		row = self.GetFocusedItem()
+		return self.macs[row] if 0 <= row < len(self.macs) else None
+
+	def focusMac(self, mac):
+		try:
+			self.Focus(self.macs.index(mac))
+		except ValueError:
+			pass
+
+
 class NetScannerFrame(wx.Frame):
 	def __init__(self, *args, scanner=None, settings=None, alarm=None, **kwargs):
 
@@ -181,17 +222,62 @@ class NetScannerFrame(wx.Frame):
 		self.SetTitle(_("NET Guard"))
 		self.Enable(False)
 		self.Hide()
+		# Widgets are built the first time the window is restored, so starting in the tray is cheap
+		self.WidgetsBuilt = False
+
+		self.taskbar_icon = TBIcon(self)
+		self.scanner = scanner
+		self.settings = settings
+		self.index = DeviceIndex(self.scanner)
+		# Lists of (SORT_*, reverse), the first one is the main key
+		self.arpSort = [(SORT_IP, False)]
+		self.devicesSort = [(SORT_NAME, False)]
+		self.updateTimer = None
+		# mac -> ip of the online devices shown in the list
+		self.online = {}
+		# The registry, kept here so drawing a row does not take the scanner lock
+		self.devices = {}
+		self.indexing = False
+
+		self.Bind(EVT_DEVICE_FOUND, self.onScannerFoundNewDevice)
+		self.Bind(EVT_UNTRUSTED_DEVICE_ALERT, self.onUntrustedDeviceFound)
+		self.Bind(EVT_IP_CONFLICT_ALERT, self.onBindingAlert)
+		self.Bind(EVT_MAC_FLAPPING_ALERT, self.onBindingAlert)
+		self.Bind(EVT_GATEWAY_CHANGED_ALERT, self.onBindingAlert)
+		self.Bind(EVT_SCAN_CYCLE_START, self.onScannerStartCycle)
+		self.Bind(EVT_SCAN_CYCLE_FINISH, self.onScannerCycleFinished)
+		self.scanner.bind(self.GetEventHandler())
+		if not self.scanner.is_alive():
+			self.scanner.start()
+
+		self.alarm = alarm
+		self.alarm.setDaemon(True)
+		self.alarm.start()
+
+		self.Bind(wx.EVT_CHAR_HOOK, self.onKey)
+		self.Bind(wx.EVT_ACTIVATE, self.onActivate)
+		self.Bind(wx.EVT_CLOSE, self.onMinimize)
+
+		self.Active = False
+		self.HasDialog = False
 
+		self.RegisterHotKey(999, self.settings["hotkey"]["modifiers"], self.settings["hotkey"]["mainKey"])
+		self.Bind(wx.EVT_HOTKEY, self.handleHotKey, id=999)
+
+	def buildWidgets(self):
 		self.frame_menubar = wx.MenuBar()
 		menu = wx.Menu()
 		item = menu.Append(wx.ID_ANY, _("Settings..."), "")
 		self.Bind(wx.EVT_MENU, self.onMenuSettings, item)
+		self.traceItem = menu.AppendCheckItem(wx.ID_ANY, _("Tracing"), "")
+		self.Bind(wx.EVT_MENU, self.onMenuTracing, self.traceItem)
 		item = menu.Append(wx.ID_ANY, _("Minimize to tray"), "")
 		self.Bind(wx.EVT_MENU, self.onMinimize, item)
 		item = menu.Append(wx.ID_ANY, _("Stop and close"), "")
 		self.Bind(wx.EVT_MENU, self.onClose, item)
 		self.frame_menubar.Append(menu, _("File"))
 		self.SetMenuBar(self.frame_menubar)
+		self.Bind(wx.EVT_MENU_OPEN, self.onMenuOpen)
 
 		self.frame_statusbar = self.CreateStatusBar(2)
 		self.frame_statusbar.SetStatusWidths([300, 300])
@@ -201,7 +287,12 @@ class NetScannerFrame(wx.Frame):
 
 		self.mainPanel = wx.Panel(self, wx.ID_ANY)
 
-		MainSizer = wx.BoxSizer(wx.HORIZONTAL)
+		MainSizer = wx.BoxSizer(wx.VERTICAL)
+
+		self.filterBox = wx.SearchCtrl(self.mainPanel, wx.ID_ANY)
+		self.filterBox.ShowCancelButton(True)
+		self.filterBox.SetDescriptiveText(_("Filter by MAC address or name"))
+		MainSizer.Add(self.filterBox, 0, wx.EXPAND, 0)
 
 		self.notebook = wx.Notebook(self.mainPanel, wx.ID_ANY)
 		MainSizer.Add(self.notebook, 1, wx.EXPAND, 0)
@@ -211,11 +302,7 @@ class NetScannerFrame(wx.Frame):
 
 		sizer_1 = wx.BoxSizer(wx.VERTICAL)
 
-		self.ARP_list = wx.ListCtrl(self.notebook_pane_1, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES)
-		self.ARP_list.AppendColumn(_("MAC address"), format=wx.LIST_FORMAT_LEFT, width=-1)
-		self.ARP_list.AppendColumn(_("IP address"), format=wx.LIST_FORMAT_LEFT, width=-1)
-		self.ARP_list.AppendColumn(_("Trust level"), format=wx.LIST_FORMAT_LEFT, width=-1)
-		self.ARP_list.AppendColumn(_("Name"), format=wx.LIST_FORMAT_LEFT, width=-1)
+		self.ARP_list = DeviceList(self.notebook_pane_1, [_("MAC address"), _("IP address"), _("Trust level"), _("Name")], self.arpText)
 		sizer_1.Add(self.ARP_list, 1, wx.EXPAND, 0)
 
 		self.notebook_pane_2 = wx.Panel(self.notebook, wx.ID_ANY)
@@ -223,12 +310,7 @@ class NetScannerFrame(wx.Frame):
 
 		sizer_2 = wx.BoxSizer(wx.VERTICAL)
 
-		self.devices_list = wx.ListCtrl(self.notebook_pane_2, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES)
-		self.devices_list.AppendColumn(_("MAC address"), format=wx.LIST_FORMAT_LEFT, width=-1)
-		self.devices_list.AppendColumn(_("First detection"), format=wx.LIST_FORMAT_LEFT, width=-1)
-		self.devices_list.AppendColumn(_("Last detection"), format=wx.LIST_FORMAT_LEFT, width=-1)
-		self.devices_list.AppendColumn(_("Trust level"), format=wx.LIST_FORMAT_LEFT, width=-1)
-		self.devices_list.AppendColumn(_("Name"), format=wx.LIST_FORMAT_LEFT, width=-1)
+		self.devices_list = DeviceList(self.notebook_pane_2, [_("MAC address"), _("First detection"), _("Last detection"), _("Trust level"), _("Name"), _("Vendor (OUI)")], self.devicesText)
 		sizer_2.Add(self.devices_list, 1, wx.EXPAND, 0)
 
 		self.notebook_pane_2.SetSizer(sizer_2)
@@ -240,34 +322,15 @@ class NetScannerFrame(wx.Frame):
 		self.Layout()
 		self.Centre()
 
-		self.taskbar_icon = TBIcon(self)
-		self.scanner = scanner
-		self.settings = settings
-
-		self.Bind(EVT_DEVICE_FOUND, self.onScannerFoundNewDevice)
-		self.Bind(EVT_UNTRUSTED_DEVICE_ALERT, self.onUntrustedDeviceFound)
-		self.Bind(EVT_SCAN_CYCLE_START, self.onScannerStartCycle)
-		self.Bind(EVT_SCAN_CYCLE_FINISH, self.onScannerCycleFinished)
-		self.scanner.bind(self.GetEventHandler())
-		self.scanner.start()
-
-		self.alarm = alarm
-		self.alarm.setDaemon(True)
-		self.alarm.start()
-
 		self.ARP_list.SetColumnsOrder([3,1,0,2])
-		self.devices_list.SetColumnsOrder([4, 0,1,2,3])
+		self.devices_list.SetColumnsOrder([4, 0,5,1,2,3])
 		self.ARP_list.SetFocus()
 
-		self.Bind(wx.EVT_CHAR_HOOK, self.onKey)
-		self.Bind(wx.EVT_ACTIVATE, self.onActivate)
-		self.Bind(wx.EVT_CLOSE, self.onMinimize)
-
-		self.Active = False
-		self.HasDialog = False
-
-		self.RegisterHotKey(999, self.settings["hotkey"]["modifiers"], self.settings["hotkey"]["mainKey"])
-		self.Bind(wx.EVT_HOTKEY, self.handleHotKey, id=999)
+		self.Bind(wx.EVT_TEXT, self.onFilter, self.filterBox)
+		self.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.onFilterCancel, self.filterBox)
+		self.ARP_list.Bind(wx.EVT_LIST_COL_CLICK, self.onColumnClick)
+		self.devices_list.Bind(wx.EVT_LIST_COL_CLICK, self.onColumnClick)
+		self.WidgetsBuilt = True
 
 	def handleHotKey(self, event):
 		self.restore()
@@ -302,58 +365,118 @@ class NetScannerFrame(wx.Frame):
 		event.Skip()
 
 	def onScannerFoundNewDevice(self, event):
-		self.update()
+		# A scan cycle finds many devices in a row, they are shown together
+		self.scheduleUpdate(UPDATE_DELAY)
 		self.playSound("detection.wav")
 
+	def scheduleUpdate(self, delay):
+		if self.updateTimer and self.updateTimer.IsRunning(): return
+		self.updateTimer = wx.CallLater(delay, self.update)
+
 	def playSound(self, wavFile):
 		if self.settings["soundEfects"] and self.Active and not self.HasDialog:
 			f = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "sounds", wavFile)
 			if os.path.exists(f):
+				import winsound
 				Thread(target=winsound.PlaySound,args=(f, winsound.SND_FILENAME)).start()
 
 	def onUntrustedDeviceFound(self, event):
 		if not self.Active:
 			self.alarm.sound(5.0)
 
+	def onBindingAlert(self, event):
+		# IP conflicts, MAC flapping and gateway changes may be ARP spoofing
+		if not self.Active:
+			self.alarm.sound(5.0)
+
 	def onScannerStartCycle(self, event):
+		if not self.WidgetsBuilt: return
 		self.frame_statusbar.SetStatusText(_("scan in progress."), 1)
 
 	def onScannerCycleFinished(self, event):
+		if not self.WidgetsBuilt: return
 		self.playSound("cycle.wav")
 		t = datetime.fromtimestamp(time()+self.scanner.timelapse)
 		status = _("Finished. Next scan at {h}:{m}").format(h=t.hour, m=t.minute)
 		self.frame_statusbar.SetStatusText(status, 1)
 
+	@traced()
 	def update(self):
+		# Hidden windows are refreshed when they are restored
+		if not self.WidgetsBuilt or not self.IsShown(): return
 		status = _("{online} devices online, {registered} registered.").format(
 			online = len(self.scanner.arp),
 			registered = len(self.scanner.devices)
 		)
 		self.frame_statusbar.SetStatusText(status, 0)
+		if self.indexing or self.index.stale:
+			# Indexing every device takes seconds with large registries, so it is done apart
+			if not self.indexing:
+				self.indexing = True
+				Thread(target=self.buildIndex, name="Device indexing", daemon=True).start()
+			self.frame_statusbar.SetStatusText(_("Indexing devices..."), 0)
+			return
 		oldFocusedItem = self.getMacFromList()
-		self.ARP_list.DeleteAllItems()
-		for ip, mac in self.scanner.arp:
-			self.ARP_list.Append([
-				mac,
-				ip,
-				(_("Red"), _("Yellow"), _("Green"))[self.scanner.devices[mac][DEVICE_INFO_TRUST_LEVEL]],
-				self.scanner.devices[mac][DEVICE_INFO_NAME]
-			])
-		self.devices_list.DeleteAllItems()
-		for mac in self.scanner.devices:
-			device_name, device_reliability, device_first, device_last = self.scanner.devices[mac]
-			self.devices_list.Append([
-				mac,
-				self.timedelta(device_first),
-				self.timedelta(device_last),
-				(_("Red"), _("Yellow"), _("Green"))[device_reliability],
-				device_name
-			])
+		self.index.refresh()
+		text = self.filterBox.GetValue()
+		self.online = {mac: ip for ip, mac in self.scanner.arp}
+		self.devices = self.scanner.devices
+		self.ARP_list.setMacs(self.index.search(text, self.arpSort, macs=self.online))
+		self.devices_list.setMacs(self.index.search(text, self.devicesSort))
 		if oldFocusedItem:
 			if self.ARP_list.HasFocus():
-				self.ARP_list.Focus(self.ARP_list.FindItem(-1, oldFocusedItem))
+				self.ARP_list.focusMac(oldFocusedItem)
 			if self.devices_list.HasFocus():
-				self.devices_list.Focus(self.devices_list.FindItem(-1, oldFocusedItem))
+				self.devices_list.focusMac(oldFocusedItem)
+
+	def buildIndex(self):
+		self.index.refresh()
+		wx.CallAfter(self.indexBuilt)
+
+	def indexBuilt(self):
+		self.indexing = False
+		self.update()
+
+	def arpText(self, mac, column):
+		if column == 0: return mac
+		if column == 1: return self.online.get(mac, "")
+		# The device may have been archived after the list was filled
+		device = self.devices.get(mac)
+		if not device: return ""
+		if column == 2: return (_("Red"), _("Yellow"), _("Green"))[device[DEVICE_INFO_TRUST_LEVEL]]
+		return device[DEVICE_INFO_NAME]
+
+	def devicesText(self, mac, column):
+		if column == 0: return mac
+		if column == 5:
+			oui = normalizeMac(mac)[:6]
+			return ":".join(oui[i:i+2] for i in range(0, 6, 2))
+		device = self.devices.get(mac)
+		if not device: return ""
+		if column == 1: return self.timedelta(device[DEVICE_INFO_FIRST_DETECTED])
+		if column == 2: return self.timedelta(device[DEVICE_INFO_LAST_DETECTED])
+		if column == 3: return (_("Red"), _("Yellow"), _("Green"))[device[DEVICE_INFO_TRUST_LEVEL]]
+		return device[DEVICE_INFO_NAME]
+
+	def onFilter(self, event):
+		self.scheduleUpdate(FILTER_DELAY)
+		event.Skip()
+
+	def onFilterCancel(self, event):
+		self.filterBox.SetValue("")
+		event.Skip()
+
+	def onColumnClick(self, event):
+		if event.GetEventObject() is self.ARP_list:
+			sort, field = self.arpSort, ARP_LIST_COLUMNS[event.GetColumn()]
+		else:
+			sort, field = self.devicesSort, DEVICES_LIST_COLUMNS[event.GetColumn()]
+		if sort and sort[0][0] == field:
+			# Clicking the main column again reverses the order
+			sort[0] = (field, not sort[0][1])
+		else:
+			sort[:] = [(field, False)] + [k for k in sort if k[0] != field][:MAX_SORT_KEYS-1]
+		self.update()
 
 	def onKey(self, event):
 		def hotkey(code, control=False, shift=False, alt=False):
@@ -371,6 +494,7 @@ class NetScannerFrame(wx.Frame):
 		if hotkey(67, True):  # control+C
 			mac = self.getMacFromList()
 			if mac:
+				import pyperclip
 				pyperclip.copy(mac)
 		if hotkey(344):  # F5
 			self.scanner.flagWait = False
@@ -378,20 +502,10 @@ class NetScannerFrame(wx.Frame):
 
 	def getMacFromList(self):
 		mac = None
-		if self.ARP_list.HasFocus() and self.ARP_list.ItemCount>0:
-			row = self.ARP_list.GetFocusedItem()
-			if row >= 0:
-				mac = self.ARP_list.GetItemText(
-					item=row,
-					col=0
-				)
-		elif self.devices_list.HasFocus() and self.devices_list.ItemCount>0:
-			row = self.devices_list.GetFocusedItem()
-			if row >= 0:
-				mac = self.devices_list.GetItemText(
-					item=row,
-					col=0
-				)
+		if self.ARP_list.HasFocus():
+			mac = self.ARP_list.focusedMac()
+		elif self.devices_list.HasFocus():
+			mac = self.devices_list.focusedMac()
 		return mac
 
 	def timedelta(self, t):
@@ -407,9 +521,23 @@ class NetScannerFrame(wx.Frame):
 		return _("{} hours ago").format(td.seconds//3600)
 
 	def restore(self):
+		if not self.WidgetsBuilt:
+			self.buildWidgets()
 		self.Enable(True)
 		self.Show()
 		self.Center()
+		self.update()
+
+	def onMenuOpen(self, event):
+		# Tracing may have stopped by itself after the configured cycles
+		self.traceItem.Check(tracer.enabled)
+		event.Skip()
+
+	def onMenuTracing(self, event):
+		stopping = tracer.enabled
+		tracer.toggle()
+		if stopping:
+			self.frame_statusbar.SetStatusText(_("Writing trace to {}").format(tracer.path), 1)
 
 	def onMenuSettings(self, event):  # wxGlade: NetScannerFrame.<event_handler>
 		lThreads = (4,8,16,32,64)
@@ -474,10 +602,14 @@ class TBIcon(wx.adv.TaskBarIcon):
 	def onClose(self, event):
 		self.frame.onClose(event)
 
-lancode = locale.normalize(locale.getdefaultlocale()[0].split("_")[0]).split("_")[0]
-if gettext.find("netguard", localedir="locale", languages=[lancode]):
-	language = gettext.translation("netguard", localedir="locale", languages=[lancode])
-	language.install()
-	_ = language.gettext
-else:
-	_ = gettext.gettext
+def _(message):
+	"""Resolves the translation the first time a string is translated and then replaces itself with it."""
+	global _
+	lancode = locale.normalize(locale.getdefaultlocale()[0].split("_")[0]).split("_")[0]
+	if gettext.find("netguard", localedir="locale", languages=[lancode]):
+		language = gettext.translation("netguard", localedir="locale", languages=[lancode])
+		language.install()
+		_ = language.gettext
+	else:
+		_ = gettext.gettext
+	return _(message)
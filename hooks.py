@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Detection hooks for NET Guard application.
+
+Runs configured actions when the scanner reports an event such as a new, untrusted or offline device:
+
+	{"type": "webhook", "target": "http://127.0.0.1:9000/alert"}    POSTs {"events": [...]} as JSON
+	{"type": "script", "target": "notify.bat"}                       runs the command with the events as JSON on stdin
+	{"type": "python", "target": "mymodule:function"}                calls function(events)
+
+Each hook may also set "events" (list of event types, all by default), "timeout", "retries", "batch" (max events per call) and "batchDelay" (seconds to wait for more events).
+Events are queued without blocking and run by a fixed pool of worker threads. A hook that keeps failing is skipped for a while (circuit breaker), so slow or broken targets never hold up the scanner or the window.
+Python hooks run on a bounded pool of threads too: a call that times out keeps its thread until it returns, and new calls fail while the pool is full.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+import json
+import subprocess
+import urllib.request
+from importlib import import_module
+from queue import Empty, Full, Queue
+from threading import BoundedSemaphore, Event, Lock, Thread
+from time import sleep, time
+
+from journal import (EVENT_DEVICE_OFFLINE, EVENT_GATEWAY_CHANGED,
+                     EVENT_IP_CONFLICT, EVENT_MAC_FLAPPING,
+                     EVENT_UNKNOWN_DEVICE, EVENT_UNTRUSTED_DEVICE)
+
+HOOK_WEBHOOK = "webhook"
+HOOK_SCRIPT = "script"
+HOOK_PYTHON = "python"
+
+DEFAULT_EVENTS = (EVENT_UNKNOWN_DEVICE, EVENT_UNTRUSTED_DEVICE, EVENT_DEVICE_OFFLINE, EVENT_IP_CONFLICT, EVENT_MAC_FLAPPING, EVENT_GATEWAY_CHANGED)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "halfOpen"
+
+
+class Hook:
+	def __init__(self, type, target, events=DEFAULT_EVENTS, timeout=5.0, retries=2, batch=20, batchDelay=1.0, failureThreshold=5, cooldown=300.0):
+		if type not in (HOOK_WEBHOOK, HOOK_SCRIPT, HOOK_PYTHON): raise ValueError("Unsupported hook type")
+		self.type = type
+		self.target = target
+		self.events = set(events)
+		self.timeout = timeout
+		self.retries = retries
+		self.batch = batch
+		self.batchDelay = batchDelay
+		self.failureThreshold = failureThreshold
+		self.cooldown = cooldown
+		self.lock = Lock()
+		self.circuit = CIRCUIT_CLOSED
+		self.failures = 0
+		self.openedAt = 0
+		self.pending = []
+		self.pendingSince = 0
+		self.sent = 0
+		self.failed = 0
+		self.skipped = 0
+		self.__function = None
+
+	def call(self, events, pool=None):
+		"""Runs the action once. Raises an exception if it fails.
+		Python hooks run on pool if given, otherwise in the calling thread without timeout."""
+		if self.type == HOOK_WEBHOOK:
+			request = urllib.request.Request(
+				self.target,
+				data=json.dumps({"events": events}).encode(),
+				headers={"Content-Type": "application/json"},
+				method="POST"
+			)
+			with urllib.request.urlopen(request, timeout=self.timeout) as response:
+				if not 200 <= response.status < 300: raise OSError("HTTP status {}".format(response.status))
+		elif self.type == HOOK_SCRIPT:
+			kwargs = {}
+			if hasattr(subprocess, "STARTUPINFO"):
+				# Do not pop up a console window, as GetMACThread
+				si = subprocess.STARTUPINFO()
+				si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+				kwargs["startupinfo"] = si
+			subprocess.run(self.target, input=json.dumps(events).encode(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.timeout, check=True, **kwargs)
+		elif pool:
+			pool.call(self.function, events, self.timeout)
+		else:
+			self.function(events)
+
+	@property
+	def function(self):
+		if self.__function is None:
+			if callable(self.target):
+				self.__function = self.target
+			else:
+				module, name = self.target.split(":")
+				self.__function = getattr(import_module(module), name)
+		return self.__function
+
+	def allow(self):
+		"""Circuit breaker: False while the hook is resting after too many failures."""
+		with self.lock:
+			if self.circuit == CIRCUIT_OPEN:
+				if time()-self.openedAt < self.cooldown: return False
+				# Let one call through to test the target
+				self.circuit = CIRCUIT_HALF_OPEN
+				return True
+			return self.circuit == CIRCUIT_CLOSED
+
+	def succeeded(self):
+		with self.lock:
+			self.circuit = CIRCUIT_CLOSED
+			self.failures = 0
+
+	def broke(self):
+		with self.lock:
+			self.failures += 1
+			if self.circuit == CIRCUIT_HALF_OPEN or self.failures >= self.failureThreshold:
+				self.circuit = CIRCUIT_OPEN
+				self.openedAt = time()
+
+
+class CallPool:
+	"""Daemon threads that run Python hooks. No more than size calls run at once, including the ones abandoned on timeout."""
+
+	def __init__(self, size=4):
+		self.__slots = BoundedSemaphore(size)
+		self.__calls = Queue()
+		for n in range(size):
+			Thread(target=self.work, name="Hook call {}".format(n+1), daemon=True).start()
+
+	def call(self, function, events, timeout):
+		"""Runs function(events) and returns its result. A call cannot be interrupted, so on timeout it is left running."""
+		if not self.__slots.acquire(blocking=False): raise TimeoutError("Too many hook calls still running")
+		done = Event()
+		result = []
+		self.__calls.put((function, events, done, result))
+		if not done.wait(timeout): raise TimeoutError("Hook {} did not finish".format(getattr(function, "__qualname__", function)))
+		succeeded, value = result[0]
+		if not succeeded: raise value
+		return value
+
+	def work(self):
+		while True:
+			function, events, done, result = self.__calls.get()
+			try:
+				result.append((True, function(events)))
+			except Exception as e:
+				result.append((False, e))
+			finally:
+				self.__slots.release()
+				done.set()
+
+
+class HookDispatcher(Thread):
+	"""Groups events into batches per hook and hands them to a bounded pool of workers."""
+
+	def __init__(self, hooks=(), workers=4, queueSize=1000, retryDelay=1.0):
+		Thread.__init__(self)
+		self.name = "Hook dispatcher"
+		self.setDaemon(True)
+		self.hooks = [hook if isinstance(hook, Hook) else Hook(**hook) for hook in hooks]
+		self.retryDelay = retryDelay
+		self.dropped = 0
+		self.__events = Queue(maxsize=queueSize)
+		self.__jobs = Queue(maxsize=workers*2)
+		self.__flagStop = False
+		self.__workers = [Thread(target=self.work, name="Hook worker {}".format(n+1), daemon=True) for n in range(workers)]
+		self.__pool = CallPool(workers) if any(hook.type == HOOK_PYTHON for hook in self.hooks) else None
+
+	def put(self, event):
+		"""Journal listener. Never blocks: events are dropped if the queue is full."""
+		try:
+			self.__events.put_nowait(event)
+		except Full:
+			self.dropped += 1
+
+	def run(self):
+		for worker in self.__workers:
+			worker.start()
+		while not self.__flagStop:
+			timeout = min([hook.batchDelay for hook in self.hooks if hook.pending] or [1.0])
+			try:
+				event = self.__events.get(timeout=timeout)
+				for hook in self.hooks:
+					if event["type"] in hook.events:
+						if not hook.pending: hook.pendingSince = time()
+						hook.pending.append(event)
+			except Empty:
+				pass
+			now = time()
+			for hook in self.hooks:
+				if hook.pending and (len(hook.pending) >= hook.batch or now-hook.pendingSince >= hook.batchDelay):
+					events, hook.pending = hook.pending[:hook.batch], hook.pending[hook.batch:]
+					hook.pendingSince = now
+					if not hook.allow():
+						hook.skipped += len(events)
+						continue
+					try:
+						self.__jobs.put_nowait((hook, events))
+					except Full:
+						# All workers are busy with slow targets
+						hook.skipped += len(events)
+		for worker in self.__workers:
+			self.__jobs.put(None)
+
+	def work(self):
+		while True:
+			job = self.__jobs.get()
+			if job is None: break
+			hook, events = job
+			for attempt in range(hook.retries+1):
+				try:
+					hook.call(events, self.__pool)
+				except Exception:
+					if attempt < hook.retries and hook.circuit == CIRCUIT_CLOSED:
+						sleep(self.retryDelay*2**attempt)
+						continue
+					hook.broke()
+					hook.failed += len(events)
+				else:
+					hook.succeeded()
+					hook.sent += len(events)
+				break
+
+	def kill(self):
+		self.__flagStop = True
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Change journal for NET Guard application.
+
+Numbers every change of the scanner state with an increasing version, so that clients can ask only for what changed since the last version they saw, and keeps the latest detection events for clients that wait for them.
+Events are numbered apart, so a detection does not make the cached state of the clients look outdated.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+from collections import OrderedDict, deque
+from threading import Condition
+from time import time
+
+__all__ = [
+	"ChangeJournal", "CHANGE_DEVICE", "CHANGE_ONLINE",
+	"EVENT_DEVICE_FOUND", "EVENT_UNKNOWN_DEVICE", "EVENT_UNTRUSTED_DEVICE", "EVENT_DEVICE_OFFLINE",
+	"EVENT_SCAN_CYCLE_START", "EVENT_SCAN_CYCLE_FINISH",
+	"EVENT_IP_CONFLICT", "EVENT_MAC_FLAPPING", "EVENT_GATEWAY_CHANGED"
+]
+
+EVENT_DEVICE_FOUND = "deviceFound"
+EVENT_UNKNOWN_DEVICE = "unknownDevice"
+EVENT_UNTRUSTED_DEVICE = "untrustedDevice"
+EVENT_DEVICE_OFFLINE = "deviceOffline"
+EVENT_SCAN_CYCLE_START = "scanCycleStart"
+EVENT_SCAN_CYCLE_FINISH = "scanCycleFinish"
+EVENT_IP_CONFLICT = "ipConflict"
+EVENT_MAC_FLAPPING = "macFlapping"
+EVENT_GATEWAY_CHANGED = "gatewayChanged"
+
+CHANGE_DEVICE = "device"
+CHANGE_ONLINE = "online"
+
+
+class ChangeJournal:
+	def __init__(self, maxChanges=65536, maxEvents=1024):
+		self.__condition = Condition()
+		self.__version = 0
+		self.__eventVersion = 0
+		self.__maxChanges = maxChanges
+		# (kind, key) -> version of its latest change, oldest change first
+		self.__changes = OrderedDict()
+		# Versions up to this one have been forgotten
+		self.__floor = 0
+		self.__events = deque(maxlen=maxEvents)
+		self.__listeners = []
+
+	def record(self, kind, key):
+		with self.__condition:
+			self.__version += 1
+			self.__changes[(kind, key)] = self.__version
+			self.__changes.move_to_end((kind, key))
+			while len(self.__changes) > self.__maxChanges:
+				self.__floor = self.__changes.popitem(last=False)[1]
+			self.__condition.notify_all()
+			return self.__version
+
+	def reset(self):
+		"""Forgets every change, so clients asking for changes since an older version reload everything."""
+		with self.__condition:
+			self.__version += 1
+			self.__changes.clear()
+			self.__floor = self.__version
+			self.__condition.notify_all()
+			return self.__version
+
+	def notify(self, eventType, **data):
+		"""Stores an event and wakes up the clients waiting for it. Returns the event dict."""
+		with self.__condition:
+			self.__eventVersion += 1
+			event = {"version": self.__eventVersion, "type": eventType, "time": time(), "data": data}
+			self.__events.append(event)
+			self.__condition.notify_all()
+		for listener in self.__listeners:
+			listener(event)
+		return event
+
+	def subscribe(self, listener):
+		"""Calls listener(event) for every new event. It runs in the scanning threads, so it must not block."""
+		# Replaced instead of modified, so notify can iterate it without locking
+		self.__listeners = self.__listeners + [listener]
+
+	def unsubscribe(self, listener):
+		self.__listeners = [l for l in self.__listeners if l != listener]
+
+	def changesSince(self, version, kind=None):
+		"""Returns the keys changed after version, or None if that version is too old to know."""
+		with self.__condition:
+			if version < self.__floor: return None
+			keys = []
+			for (k, key), v in reversed(self.__changes.items()):
+				if v <= version: break
+				if kind is None or k == kind: keys.append(key)
+			return keys
+
+	def eventsSince(self, version):
+		with self.__condition:
+			return [e for e in self.__events if e["version"] > version]
+
+	def waitEvents(self, version, timeout=None):
+		"""Blocks until there are events newer than version or the timeout expires, and returns them."""
+		with self.__condition:
+			self.__condition.wait_for(lambda: self.__events and self.__events[-1]["version"] > version, timeout)
+			return [e for e in self.__events if e["version"] > version]
+
+	@property
+	def version(self):
+		"""Version of the latest state change."""
+		return self.__version
+
+	@property
+	def eventVersion(self):
+		"""Version of the latest event, in a numbering of its own."""
+		return self.__eventVersion
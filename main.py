@@ -14,15 +14,15 @@ See the file COPYING for more details.
 
 import json
 import os
+import signal
 import sys
-import winsound
 from threading import Event, Thread, Timer
 from time import sleep
 
 import wx
 
-from gui import NetScannerFrame
 from scanner import LANScanner
+from tracing import tracer
 
 
 class Alarm(Thread):
@@ -32,6 +32,7 @@ class Alarm(Thread):
 		self.__flagStop = False
 
 	def run(self):
+		import winsound
 		while True:
 			self.__event.wait()
 			if self.__flagStop: break
@@ -96,21 +97,74 @@ class netScannerApp(wx.App):
 
 	def OnInit(self):
 		settings = Settings(os.path.join(self.Path, "settings.json"))
+		tracer.path = os.path.join(self.Path, "trace.json")
+		if settings.get("trace"):
+			# e.g. {"cycles": 3, "sampleInterval": 0.005}
+			tracer.start(**dict({"path": tracer.path}, **settings["trace"]))
+		# Ctrl+Break on Windows consoles, kill -USR1 elsewhere, switches tracing on and off. The File menu also does.
+		toggleSignal = getattr(signal, "SIGBREAK", None) or getattr(signal, "SIGUSR1", None)
+		if toggleSignal:
+			signal.signal(toggleSignal, tracer.toggle)
 		scanner = LANScanner(
 			threads=settings["threads"],
 			timelapse=settings["timelapse"],
-			devices=os.path.join(self.Path, "devices.json")
+			devices=os.path.join(self.Path, "devices.json"),
+			presence=os.path.join(self.Path, "presence.json"),
+			archiveAfter=settings.get("archiveDays", 90)*86400
 		)
 		if not scanner.getmacaddressPath:
 			wx.MessageBox("Required component getmacaddress.exe is missing", "An error occurred")
 			return False
+		# Every sink subscribes to the journal before scanning starts, so the first detections reach them
+		if settings.get("eventLog"):
+			# Optional NDJSON export, e.g. {"path": "events.ndjson", "maxBytes": 10485760}
+			from eventlog import EventLog
+			try:
+				self.eventLog = EventLog(**settings["eventLog"])
+			except ValueError as e:
+				wx.MessageBox(str(e), "Event log disabled")
+			else:
+				scanner.journal.subscribe(self.eventLog.put)
+				self.eventLog.start()
+		if settings.get("collector"):
+			# Optional central collector, e.g. {"address": "10.0.0.2:8766", "site": "office"}
+			from collector import CollectorClient
+			self.collectorClient = CollectorClient(scanner, **settings["collector"])
+			self.collectorClient.start()
+		if settings.get("hooks"):
+			# e.g. [{"type": "webhook", "target": "http://127.0.0.1:9000/alert"}], see hooks.py
+			from hooks import HookDispatcher
+			try:
+				self.hooks = HookDispatcher(settings["hooks"])
+			except (ValueError, TypeError) as e:
+				# A malformed hook entry in the settings
+				wx.MessageBox(str(e), "Hooks disabled")
+			else:
+				scanner.journal.subscribe(self.hooks.put)
+				self.hooks.start()
+		# Also needed with --hidden: the frame owns the tray icon and the hotkey that bring the window back.
+		# Only its widgets are deferred until the first restore.
+		from gui import NetScannerFrame
 		alarm = Alarm()
+		# The frame binds its event handler to the scanner and then starts it, before the API and the window are shown
 		self.frame = NetScannerFrame(None, wx.ID_ANY, self.Name, scanner=scanner, settings=settings, alarm=alarm)
 		self.SetTopWindow(self.frame)
+		if settings.get("apiPort"):
+			# Optional local API, enabled by setting apiPort in settings.json
+			from api import APIServer
+			self.api = APIServer(scanner, port=settings["apiPort"])
+			self.api.start()
 		if not "--hidden" in [i.lower() for i in sys.argv]:
 			self.frame.restore()
 		return True
 
+	def OnExit(self):
+		tracer.stop()
+		if hasattr(self, "eventLog"):
+			self.eventLog.kill()
+			self.eventLog.join(5.0)
+		return super().OnExit()
+
 if __name__ == "__main__":
 	app = netScannerApp(0)
 	app.MainLoop()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Presence history for NET Guard application.
+
+Records when every device has been online as run-length encoded intervals, so the history of years of scans takes only a few numbers per device.
+Old intervals are downsampled and eventually discarded.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+import json
+import os
+from bisect import bisect_left, bisect_right
+from time import time
+
+DAY = 86400
+HOUR = 3600
+
+
+class PresenceHistory:
+	"""Per MAC sightings stored as sorted, non overlapping [start, end] intervals."""
+
+	def __init__(self, f="", retention=366*DAY, fineTime=7*DAY, coarseGap=HOUR, autoload=True):
+		self.__presenceFile = f
+		self.retention = retention
+		self.fineTime = fineTime
+		self.coarseGap = coarseGap
+		self.__starts = {}
+		self.__ends = {}
+		# day number -> MACs seen that day, used to narrow range queries
+		self.__days = {}
+		self.__lastCompact = 0
+		if autoload: self.load()
+
+	def record(self, mac, timestamp, gap):
+		"""Adds a sighting. It extends the last interval when the previous sighting is less than gap seconds old."""
+		timestamp = int(timestamp)
+		starts = self.__starts.get(mac)
+		if starts is None:
+			starts = self.__starts[mac] = []
+			self.__ends[mac] = []
+		ends = self.__ends[mac]
+		if ends and timestamp - ends[-1] <= gap:
+			firstDay = ends[-1]//DAY
+			if timestamp > ends[-1]: ends[-1] = timestamp
+		else:
+			firstDay = timestamp//DAY
+			starts.append(timestamp)
+			ends.append(timestamp)
+		for day in range(firstDay, timestamp//DAY+1):
+			self.__days.setdefault(day, set()).add(mac)
+
+	def onlineBetween(self, t1, t2):
+		"""Returns the set of MACs that were online at some moment between t1 and t2."""
+		candidates = set()
+		for day in range(int(t1)//DAY, int(t2)//DAY+1):
+			candidates.update(self.__days.get(day, ()))
+		return {mac for mac in candidates if self.wasOnline(mac, t1, t2)}
+
+	def wasOnline(self, mac, t1, t2):
+		# Intervals do not overlap, so only the last one starting before t2 can reach t1
+		starts = self.__starts.get(mac, [])
+		i = bisect_right(starts, t2)
+		return i > 0 and self.__ends[mac][i-1] >= t1
+
+	def uptime(self, mac, t1, t2):
+		"""Returns the number of seconds that mac was online between t1 and t2."""
+		starts = self.__starts.get(mac)
+		if not starts: return 0
+		ends = self.__ends[mac]
+		total = 0
+		i = bisect_left(ends, t1)
+		while i < len(starts) and starts[i] <= t2:
+			total += max(0, min(ends[i], t2) - max(starts[i], t1))
+			i += 1
+		return total
+
+	def intervals(self, mac):
+		return list(zip(self.__starts.get(mac, []), self.__ends.get(mac, [])))
+
+	def compact(self, now=None, force=False):
+		"""Discards intervals older than the retention time and merges the old ones separated by short gaps."""
+		now = int(now or time())
+		if not force and now - self.__lastCompact < HOUR: return
+		self.__lastCompact = now
+		expiry = now - self.retention
+		fineLimit = now - self.fineTime
+		for mac in list(self.__starts):
+			starts, ends = self.__starts[mac], self.__ends[mac]
+			keep = bisect_left(ends, expiry)
+			del starts[:keep]
+			del ends[:keep]
+			if not starts:
+				del self.__starts[mac]
+				del self.__ends[mac]
+				continue
+			i = 1
+			while i < len(starts) and starts[i] < fineLimit:
+				if starts[i] - ends[i-1] <= self.coarseGap:
+					ends[i-1] = max(ends[i-1], ends[i])
+					del starts[i]
+					del ends[i]
+				else:
+					i += 1
+		for day in [d for d in self.__days if d < expiry//DAY]:
+			del self.__days[day]
+
+	def load(self):
+		if self.__presenceFile and os.path.exists(self.__presenceFile):
+			with open(self.__presenceFile, "r") as f:
+				d = json.load(f)
+			for mac, encoded in d.items():
+				self.__starts[mac], self.__ends[mac] = decode(encoded)
+				for start, end in zip(self.__starts[mac], self.__ends[mac]):
+					for day in range(start//DAY, end//DAY+1):
+						self.__days.setdefault(day, set()).add(mac)
+			return True
+		return False
+
+	def snapshot(self):
+		"""Returns the encoded history, ready to be saved while new sightings are recorded."""
+		return {mac: encode(self.__starts[mac], self.__ends[mac]) for mac in self.__starts}
+
+	def save(self, snapshot=None):
+		if self.__presenceFile:
+			if snapshot is None: snapshot = self.snapshot()
+			with open(self.__presenceFile, "w") as f:
+				json.dump(snapshot, f, separators=(",", ":"))
+			return True
+		return False
+
+	def __len__(self):
+		return len(self.__starts)
+
+	def __contains__(self, mac):
+		return mac in self.__starts
+
+
+def encode(starts, ends):
+	"""Delta encodes intervals as a flat list: first start, then alternating lengths and gaps."""
+	encoded = []
+	previous = 0
+	for start, end in zip(starts, ends):
+		encoded.append(start - previous)
+		encoded.append(end - start)
+		previous = end
+	return encoded
+
+def decode(encoded):
+	starts, ends = [], []
+	previous = 0
+	for i in range(0, len(encoded), 2):
+		start = previous + encoded[i]
+		previous = start + encoded[i+1]
+		starts.append(start)
+		ends.append(previous)
+	return starts, ends
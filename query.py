@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Search and sort over the devices of NET Guard application.
+
+Keeps precomputed sort keys and a trigram index of MAC addresses and names for every registered device.
+The index is updated incrementally with the changes recorded in the scanner journal, so a search only looks at the devices that contain the typed text.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+from socket import inet_aton
+
+from journal import CHANGE_DEVICE
+from scanner import (DEVICE_INFO_FIRST_DETECTED, DEVICE_INFO_LAST_DETECTED,
+                     DEVICE_INFO_NAME, DEVICE_INFO_TRUST_LEVEL)
+
+SORT_MAC = 0
+SORT_IP = 1
+SORT_FIRST_DETECTED = 2
+SORT_LAST_DETECTED = 3
+SORT_TRUST_LEVEL = 4
+SORT_NAME = 5
+# Devices of the same manufacturer share the first three bytes of the MAC address (OUI)
+SORT_VENDOR = 6
+
+NO_IP = b"\xff"*5
+
+
+def ipKey(ip):
+	try:
+		return inet_aton(ip)
+	except (OSError, TypeError):
+		return NO_IP
+
+def normalizeMac(mac):
+	return mac.strip().lower().replace(":", "").replace("-", "")
+
+def trigrams(text):
+	return {text[i:i+3] for i in range(len(text)-2)}
+
+
+class DeviceIndex:
+	def __init__(self, scanner):
+		self.scanner = scanner
+		self.__version = None
+		# mac -> tuple of sort keys, in SORT_* order
+		self.__keys = {}
+		# mac -> lowercase searchable text
+		self.__texts = {}
+		# trigram -> set of MACs whose text contains it
+		self.__trigrams = {}
+		# sort spec -> all MACs in that order, reused while typing until the devices change
+		self.__orders = {}
+
+	@property
+	def stale(self):
+		"""True when refresh has to index every device, which is slow with large registries."""
+		return self.__version is None or self.scanner.journal.changesSince(self.__version, CHANGE_DEVICE) is None
+
+	def refresh(self):
+		"""Reindexes the devices changed since the last refresh."""
+		journal = self.scanner.journal
+		devices = self.scanner.devices
+		bindings = self.scanner.bindings
+		# Only a snapshot is taken under the lock, so the scanner is not held up while indexing
+		with self.scanner.lock:
+			version = journal.version
+			changed = journal.changesSince(self.__version, CHANGE_DEVICE) if self.__version is not None else None
+			rebuild = changed is None
+			if rebuild: changed = list(devices)
+			snapshot = [(mac, devices[mac][:], bindings.ipOf(mac)) if mac in devices else (mac, None, None) for mac in changed]
+		if rebuild:
+			self.__keys.clear()
+			self.__texts.clear()
+			self.__trigrams.clear()
+		if snapshot: self.__orders.clear()
+		for mac, info, ip in snapshot:
+			if info:
+				self.index(mac, info, ip)
+			else:
+				self.__keys.pop(mac, None)
+				self.remove(mac)
+		self.__version = version
+
+	def index(self, mac, info, ip=None):
+		name = info[DEVICE_INFO_NAME]
+		normalized = normalizeMac(mac)
+		self.__keys[mac] = (
+			normalized,
+			ipKey(ip),
+			info[DEVICE_INFO_FIRST_DETECTED],
+			info[DEVICE_INFO_LAST_DETECTED],
+			info[DEVICE_INFO_TRUST_LEVEL],
+			name.lower(),
+			normalized[:6]
+		)
+		# Separator keeps trigrams from spanning MAC and name
+		text = "{}\n{}\n{}".format(normalized, mac.strip().lower(), name.lower())
+		if self.__texts.get(mac) == text: return
+		self.remove(mac)
+		self.__texts[mac] = text
+		for t in trigrams(text):
+			self.__trigrams.setdefault(t, set()).add(mac)
+
+	def remove(self, mac):
+		text = self.__texts.pop(mac, None)
+		if text is None: return
+		for t in trigrams(text):
+			macs = self.__trigrams.get(t)
+			if macs:
+				macs.discard(mac)
+				if not macs: del self.__trigrams[t]
+
+	def search(self, text="", sort=((SORT_NAME, False),), macs=None):
+		"""Returns the MACs whose address or name contains text, sorted by the (SORT_*, reverse) pairs in sort.
+		If macs is given, only those devices are considered."""
+		text = text.strip().lower()
+		if len(text) >= 3:
+			candidates = None
+			for t in sorted(trigrams(text), key=lambda t: len(self.__trigrams.get(t, ()))):
+				found = self.__trigrams.get(t)
+				if not found: return []
+				candidates = found if candidates is None else candidates & found
+			if macs is not None: candidates = candidates & set(macs)
+			# A single trigram needs no check, every candidate contains it
+			results = candidates if len(text) == 3 else {mac for mac in candidates if text in self.__texts[mac]}
+		else:
+			pool = self.__texts if macs is None else [mac for mac in macs if mac in self.__texts]
+			results = {mac for mac in pool if text in self.__texts[mac]} if text else set(pool)
+		if not sort: return list(results)
+		if len(results) > len(self.__keys)//8:
+			# Large result sets are cheaper to filter out of the cached full ordering than to sort
+			return [mac for mac in self.sorted(sort) if mac in results]
+		return self.sort(list(results), sort)
+
+	def sorted(self, sort):
+		sort = tuple(sort)
+		order = self.__orders.get(sort)
+		if order is None:
+			order = self.__orders[sort] = self.sort(list(self.__keys), sort)
+		return order
+
+	def sort(self, macs, sort):
+		# Stable sorts from the last key to the first give a multi-key sort with independent directions
+		for field, reverse in reversed(sort):
+			macs.sort(key=lambda mac: self.__keys[mac][field], reverse=reverse)
+		return macs
+
+	def __len__(self):
+		return len(self.__keys)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Device registry for NET Guard application.
+
+Keeps the devices seen recently in memory as compact records, and moves the devices not seen for a long time to an archive file. Only the line of a device that comes back is read.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+import json
+import os
+from array import array
+from bisect import bisect_left
+from time import time
+
+DAY = 86400
+
+
+class DeviceRecord:
+	"""Device info. Behaves as the (name, trustLevel, first, last) tuple it replaces."""
+
+	__slots__ = ("name", "trustLevel", "first", "last")
+
+	def __init__(self, name, trustLevel, first, last):
+		self.name = name
+		self.trustLevel = trustLevel
+		self.first = first
+		self.last = last
+
+	def __getitem__(self, index):
+		return (self.name, self.trustLevel, self.first, self.last)[index]
+
+	def __iter__(self):
+		yield self.name
+		yield self.trustLevel
+		yield self.first
+		yield self.last
+
+	def __len__(self):
+		return 4
+
+	def __eq__(self, other):
+		return tuple(self) == tuple(other)
+
+	def __repr__(self):
+		return "DeviceRecord{}".format(tuple(self))
+
+
+def macToInt(mac):
+	return int(mac.replace(":", "").replace("-", ""), 16)
+
+
+def archiveLine(mac, info):
+	return (json.dumps([mac]+list(info))+"\n").encode()
+
+def lineMac(line):
+	# MACs need no escaping, so the first string of the line ends at the next quote
+	return line[2:line.index(b'"', 2)].decode()
+
+
+class DeviceRegistry(dict):
+	"""MAC -> DeviceRecord for the active devices, backed by a lazily read archive file."""
+
+	def __init__(self, f="", archiveAfter=90*DAY, autoload=True):
+		super().__init__()
+		self.__devicesFile = f
+		self.__archiveFile = os.path.splitext(f)[0]+".archive.json" if f else ""
+		self.archiveAfter = archiveAfter
+		# Sorted 48 bit MACs of the archived devices and the offsets of their lines, read the first time it is needed
+		self.__archiveIndex = None
+		self.__archiveOffsets = None
+		# Restored MACs still in the archive file
+		self.__restored = set()
+		self.__lastArchive = 0
+		if autoload: self.load()
+
+	def __setitem__(self, mac, info):
+		if not isinstance(info, DeviceRecord):
+			info = DeviceRecord(*info)
+		super().__setitem__(mac, info)
+
+	def load(self):
+		if self.__devicesFile and os.path.exists(self.__devicesFile):
+			with open(self.__devicesFile, "r") as f:
+				d = json.load(f)
+			for mac, info in d.items():
+				super().__setitem__(mac, DeviceRecord(*info))
+			return True
+		return False
+
+	def save(self):
+		if self.__devicesFile:
+			with open(self.__devicesFile, "w") as f:
+				json.dump({mac: list(info) for mac, info in self.items()}, f)
+			return True
+		return False
+
+	def isArchived(self, mac):
+		return self.findArchived(mac) is not None
+
+	def findArchived(self, mac):
+		"""Returns the offset of mac in the archive file, or None if it is not archived."""
+		if mac in self.__restored: return None
+		index = self.archiveIndex
+		key = macToInt(mac)
+		i = bisect_left(index, key)
+		if i < len(index) and index[i] == key: return self.__archiveOffsets[i]
+		return None
+
+	def restore(self, mac):
+		"""Brings mac back from the archive. Returns False if it is not archived.
+		Only its line is read. The archive file keeps it until compactArchive, which runs after the devices file is saved."""
+		if mac in self: return True
+		offset = self.findArchived(mac)
+		if offset is None: return False
+		with open(self.__archiveFile, "rb") as f:
+			f.seek(offset)
+			info = json.loads(f.readline())[1:]
+		self[mac] = info
+		self.__restored.add(mac)
+		return True
+
+	def archive(self, now=None, force=False):
+		"""Moves the devices not detected for archiveAfter seconds to the archive file. Returns the list of moved MACs."""
+		now = now or time()
+		if not self.__archiveFile or not self.archiveAfter: return []
+		if not force and now - self.__lastArchive < DAY: return []
+		self.__lastArchive = now
+		expired = [mac for mac, info in self.items() if now - info.last > self.archiveAfter]
+		if not expired: return []
+		self.writeArchive({mac: self.pop(mac) for mac in expired})
+		return expired
+
+	def compactArchive(self):
+		"""Drops the restored devices from the archive file. Call it after saving the devices file, so a crash loses none."""
+		if self.__restored: self.writeArchive({})
+
+	def archiveLines(self):
+		"""Yields (mac, line) for every line of the archive file, one JSON array [mac, name, trustLevel, first, last] per line."""
+		if not self.__archiveFile or not os.path.exists(self.__archiveFile): return
+		legacy = self.legacyArchive()
+		with open(self.__archiveFile, "rb") as f:
+			if legacy:
+				for mac, info in json.load(f).items():
+					yield mac, archiveLine(mac, info)
+				return
+			for line in f:
+				yield lineMac(line), line
+
+	def readArchive(self):
+		return {mac: json.loads(line)[1:] for mac, line in self.archiveLines() if mac not in self.__restored}
+
+	def writeArchive(self, moved):
+		"""Rewrites the archive file with the devices moved to it and without the active ones."""
+		index = []
+		with open(self.__archiveFile+".tmp", "wb") as f:
+			for mac, line in self.archiveLines():
+				if mac in self or mac in moved: continue
+				index.append((macToInt(mac), f.tell()))
+				f.write(line)
+			for mac, info in moved.items():
+				index.append((macToInt(mac), f.tell()))
+				f.write(archiveLine(mac, info))
+		os.replace(self.__archiveFile+".tmp", self.__archiveFile)
+		self.setArchiveIndex(index)
+		self.__restored.clear()
+
+	def setArchiveIndex(self, index):
+		index.sort()
+		self.__archiveIndex = array("Q", (key for key, offset in index))
+		self.__archiveOffsets = array("Q", (offset for key, offset in index))
+
+	@property
+	def archiveIndex(self):
+		if self.__archiveIndex is None:
+			if self.legacyArchive():
+				# Earlier versions wrote a single JSON object, which has no lines to seek to
+				self.writeArchive({})
+			else:
+				index = []
+				offset = 0
+				for mac, line in self.archiveLines():
+					index.append((macToInt(mac), offset))
+					offset += len(line)
+				self.setArchiveIndex(index)
+		return self.__archiveIndex
+
+	def legacyArchive(self):
+		if not self.__archiveFile or not os.path.exists(self.__archiveFile): return False
+		with open(self.__archiveFile, "rb") as f:
+			return f.read(1) == b"{"
+
+	@property
+	def archived(self):
+		return len(self.archiveIndex)-len(self.__restored)
@@ -14,21 +14,33 @@ This file is covered by the GNU General Public License.
 See the file COPYING for more details.
 """
 
-import json
 import os
 import subprocess
 import sys
-from socket import gethostbyname, gethostname
-from threading import Lock, Thread, enumerate
+from socket import gethostbyname, gethostname, inet_aton
+from threading import Thread, enumerate
 from time import sleep, time
 
 import wx.lib.newevent
 
+from bindings import (ALERT_GATEWAY_CHANGED, ALERT_IP_CONFLICT,
+                      ALERT_MAC_FLAPPING, BindingIndex)
+from journal import (CHANGE_DEVICE, CHANGE_ONLINE, EVENT_DEVICE_FOUND,
+                     EVENT_DEVICE_OFFLINE, EVENT_SCAN_CYCLE_FINISH,
+                     EVENT_SCAN_CYCLE_START, EVENT_UNKNOWN_DEVICE,
+                     EVENT_UNTRUSTED_DEVICE, ChangeJournal)
+from presence import PresenceHistory
+from registry import DeviceRegistry
+from tracing import TracedLock, traced, tracer
+
 Event_DeviceFound, EVT_DEVICE_FOUND = wx.lib.newevent.NewEvent()
 Event_UnknownDeviceAlert, EVT_UNKNOWN_DEVICE_ALERT = wx.lib.newevent.NewEvent()
 Event_UntrustedDeviceAlert, EVT_UNTRUSTED_DEVICE_ALERT = wx.lib.newevent.NewEvent()
 Event_ScanCycleStart, EVT_SCAN_CYCLE_START = wx.lib.newevent.NewEvent()
 Event_ScanCycleFinish, EVT_SCAN_CYCLE_FINISH = wx.lib.newevent.NewEvent()
+Event_IPConflictAlert, EVT_IP_CONFLICT_ALERT = wx.lib.newevent.NewEvent()
+Event_MACFlappingAlert, EVT_MAC_FLAPPING_ALERT = wx.lib.newevent.NewEvent()
+Event_GatewayChangedAlert, EVT_GATEWAY_CHANGED_ALERT = wx.lib.newevent.NewEvent()
 
 DEVICE_INFO_NAME = 0
 DEVICE_INFO_TRUST_LEVEL = 1
@@ -40,22 +52,27 @@ TRUST_LEVEL_YELLOW = 1
 TRUST_LEVEL_GREEN = 2
 
 class LANScanner(Thread):
-	def __init__(self, timelapse=180, threads=8, devices=""):
+	def __init__(self, timelapse=180, threads=8, devices="", gateway=None, presence="", archiveAfter=90*86400):
 		Thread.__init__(self)
 		self.name = "LAN Scanner"
 		self.setDaemon(True)
 		self.flagStop = False
 		self.flagWait = False
-		self.lock = Lock()
+		self.lock = TracedLock("scanner.lock")
 		self.__timelapse = timelapse
 		self.__nThreads = threads
 		self.__arp = []
-		self.__devicesFile = devices
-		if os.path.exists(devices):
-			with open(devices, "r") as f:
-				self.__devices = json.load(f)
-		else:
-			self.__devices = {}
+		# mac -> ip of the devices online in the previous cycle
+		self.__previousOnline = {}
+		# ip -> mac of the last complete cycle, kept while the next one is scanned
+		self.__online = {}
+		# Two missed cycles release an IP
+		self.__bindings = BindingIndex(gateway=gateway, conflictWindow=2*timelapse)
+		self.__presence = PresenceHistory(presence, autoload=False)
+		self.__journal = ChangeJournal()
+		self.__stats = {"cycles": 0, "cycleStart": None, "cycleFinish": None, "cycleDuration": None}
+		# Files are read by the scanning thread, so the application does not wait for them
+		self.__devices = DeviceRegistry(devices, archiveAfter=archiveAfter, autoload=False)
 		self.__EventHandler = None
 		self.__eventDeviceFound = Event_DeviceFound()
 		self.__eventUnknownDeviceAlert = Event_UnknownDeviceAlert()
@@ -73,69 +90,141 @@ class LANScanner(Thread):
 	def run(self):
 		if not self.getmacaddressPath:
 			raise RuntimeError("Required component getmacaddress.exe is missing.")
+		self.load()
 		ip = gethostbyname(gethostname())
 		ip = ip.split(".")[:-1]
+		if not self.__bindings.gateway:
+			# Assume the usual router address when no gateway was given
+			self.__bindings.gateway = ".".join(ip+["1"])
 		while True:
 			if self.flagStop: break
-			if self.__EventHandler:
-				wx.PostEvent(self.__EventHandler, self.__event_ScanCycleStart)
-			self.__arp.clear()
-			scanChunkThreads=[]
-			for r in range (1, 257, 256//self.__nThreads):
-				scanChunkThreads.append(GetMACThread(
-					parent=self,
-					lock=self.lock,
-					ipRange=[".".join(ip+[str(i)]) for i in range (r,r+256//self.__nThreads)]
-				))
-			for th in scanChunkThreads:
-				th.start()
-			for th in scanChunkThreads:
-				th.join()
-			if self.__EventHandler:
-				wx.PostEvent(self.__EventHandler, self.__event_ScanCycleFinish)
-			self.saveDevices()
+			with tracer.span("startCycle", "cycle"):
+				self.startCycle()
+			with tracer.span("scan", "cycle", threads=self.__nThreads):
+				scanChunkThreads=[]
+				for r in range (1, 257, 256//self.__nThreads):
+					scanChunkThreads.append(GetMACThread(
+						parent=self,
+						lock=self.lock,
+						ipRange=[".".join(ip+[str(i)]) for i in range (r,r+256//self.__nThreads)]
+					))
+				for th in scanChunkThreads:
+					th.start()
+				for th in scanChunkThreads:
+					th.join()
+			with tracer.span("finishCycle", "cycle"):
+				self.finishCycle()
+			tracer.cycleFinished()
 			self.flagWait = True
 			for remaindTime in range(self.__timelapse, 0, -1):
 				if not self.flagWait or self.flagStop: break
 				sleep(1.0)
 			self.flagWait = False
 
+	def load(self):
+		"""Reads the saved devices and presence history. Called by the scanning thread."""
+		with self.lock:
+			self.__devices.load()
+			self.__presence.load()
+			# Clients that indexed the devices before they were loaded must start over
+			self.__journal.reset()
+
+	def startCycle(self):
+		if self.__EventHandler:
+			wx.PostEvent(self.__EventHandler, self.__event_ScanCycleStart)
+		with self.lock:
+			self.__previousOnline = {mac: ip for ip, mac in self.__arp}
+			self.__arp.clear()
+			self.__bindings.newCycle()
+			self.__stats["cycleStart"] = time()
+		self.__journal.notify(EVENT_SCAN_CYCLE_START, cycle=self.__stats["cycles"]+1)
+
+	def finishCycle(self):
+		with self.lock:
+			self.__stats["cycles"] += 1
+			self.__stats["cycleFinish"] = time()
+			self.__stats["cycleDuration"] = self.__stats["cycleFinish"] - self.__stats["cycleStart"]
+			online = {mac for ip, mac in self.__arp}
+			if not self.flagStop:
+				# Only the IPs that differ from the previous complete cycle are changes
+				table = dict(self.__arp)
+				for ip in set(table).union(self.__online):
+					if table.get(ip) != self.__online.get(ip):
+						self.__journal.record(CHANGE_ONLINE, ip)
+				self.__online = table
+		if not self.flagStop:
+			# An interrupted cycle does not tell which devices left
+			for mac, ip in self.__previousOnline.items():
+				if mac not in online:
+					self.__journal.notify(EVENT_DEVICE_OFFLINE, ip=ip, mac=mac)
+		self.__journal.notify(EVENT_SCAN_CYCLE_FINISH, cycle=self.__stats["cycles"], duration=self.__stats["cycleDuration"], online=len(self.__arp))
+		if self.__EventHandler:
+			wx.PostEvent(self.__EventHandler, self.__event_ScanCycleFinish)
+		with self.lock:
+			# Archived devices are gone from the registry, so clients must drop them
+			for mac in self.__devices.archive():
+				self.__journal.record(CHANGE_DEVICE, mac)
+		self.saveDevices()
+		with self.lock:
+			# Devices restored during the cycle are saved now, so the archive can let them go
+			self.__devices.compactArchive()
+		with self.lock:
+			self.__presence.compact()
+			presence = self.__presence.snapshot()
+		# The file is written without holding up the scanning threads
+		self.__presence.save(presence)
+
 	def bind(self, handler):
 		self.__EventHandler = handler
 
 	def update(self, ip, mac):
 		if ip.split(".")[-1] == "255": return
+		now = time()
 		self.__arp.append((ip, mac))
-		self.updateDevices(mac, last=time())
+		alerts = self.__bindings.observe(ip, mac, now)
+		# A device missing a whole cycle is considered offline in between
+		self.__presence.record(mac, now, gap=2*self.__timelapse)
+		self.updateDevices(mac, last=now)
+		self.__journal.notify(EVENT_DEVICE_FOUND, ip=ip, mac=mac)
+		if self.__devices[mac][DEVICE_INFO_TRUST_LEVEL] == TRUST_LEVEL_RED:
+			self.__journal.notify(EVENT_UNTRUSTED_DEVICE, ip=ip, mac=mac)
+		for alert, details in alerts:
+			self.__journal.notify(alert, **details)
 		if self.__EventHandler:
 			wx.PostEvent(self.__EventHandler, self.__eventDeviceFound)
 			if self.__devices[mac][DEVICE_INFO_TRUST_LEVEL] == TRUST_LEVEL_RED:
 				wx.PostEvent(self.__EventHandler, self.__eventUntrustedDeviceAlert)
+			for alert, details in alerts:
+				if alert == ALERT_IP_CONFLICT:
+					wx.PostEvent(self.__EventHandler, Event_IPConflictAlert(**details))
+				elif alert == ALERT_MAC_FLAPPING:
+					wx.PostEvent(self.__EventHandler, Event_MACFlappingAlert(**details))
+				elif alert == ALERT_GATEWAY_CHANGED:
+					wx.PostEvent(self.__EventHandler, Event_GatewayChangedAlert(**details))
 
+	@traced()
 	def updateDevices(self, mac, name="", trustLevel=-1, first=None, last=None, save=False):
-		if mac in self.__devices:
-			device_name, device_reliability, device_first, device_last = self.__devices[mac]
-			device_name = name if name else device_name
-			device_reliability = trustLevel if trustLevel >= 0 else device_reliability
-			device_first = first if first else device_first
-			device_last = last if last else device_last
-			self.__devices[mac] = (device_name, device_reliability, device_first, device_last)
+		if mac in self.__devices or self.__devices.restore(mac):
+			device = self.__devices[mac]
+			if name: device.name = name
+			if trustLevel >= 0: device.trustLevel = trustLevel
+			if first: device.first = first
+			if last: device.last = last
 		else:
 			save = True
 			if not last: last = time()
 			if not first: first = last
 			if trustLevel < 0: trustLevel = TRUST_LEVEL_RED
 			self.__devices[mac] = (name, trustLevel, first, last)
+			self.__journal.notify(EVENT_UNKNOWN_DEVICE, mac=mac)
 			if self.__EventHandler:
 				wx.PostEvent(self.__EventHandler, self.__eventUnknownDeviceAlert)
+		self.__journal.record(CHANGE_DEVICE, mac)
 		if save: self.saveDevices()
 
+	@traced()
 	def saveDevices(self):
-		if self.__devicesFile:
-			with open(self.__devicesFile, "w") as f:
-				json.dump(self.__devices, f)
-			return True
-		return False
+		return self.__devices.save()
 
 	def kill(self):
 		self.flagStop = True
@@ -144,11 +233,37 @@ class LANScanner(Thread):
 	def arp(self):
 		with self.lock:
 			arp = self.__arp.copy()
-		def k(item):
-			return int(item[0].split(".")[-1])
-		arp.sort(key=k)
+		arp.sort(key=lambda item: inet_aton(item[0]))
 		return arp
 
+	@property
+	def bindings(self):
+		return self.__bindings
+
+	@property
+	def presence(self):
+		return self.__presence
+
+	@property
+	def journal(self):
+		return self.__journal
+
+	@property
+	def stats(self):
+		with self.lock:
+			stats = self.__stats.copy()
+		stats["online"] = len(self.__arp)
+		stats["registered"] = len(self.__devices)
+		return stats
+
+	@property
+	def online(self):
+		"""(ip, mac) of the devices found in the last complete scan cycle, by IP."""
+		with self.lock:
+			online = list(self.__online.items())
+		online.sort(key=lambda item: inet_aton(item[0]))
+		return online
+
 	@property
 	def devices(self):
 		with self.lock:
@@ -164,6 +279,7 @@ class LANScanner(Thread):
 		if not isinstance(value, int): raise TypeError("An int was expected")
 		if value<60 or value>1800: raise ValueError("The supported range is 60-900")
 		self.__timelapse = value
+		self.__bindings.conflictWindow = 2*value
 
 	@property
 	def threads(self):
@@ -193,10 +309,11 @@ class GetMACThread(Thread):
 				exe=self.parent.getmacaddressPath,
 				ip=ip_address
 			)
-			si = subprocess.STARTUPINFO()
-			si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-			p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=si)
-			stdout, stderr = p.communicate()
+			with tracer.span("resolve", "resolution", ip=ip_address):
+				si = subprocess.STARTUPINFO()
+				si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+				p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=si)
+				stdout, stderr = p.communicate()
 			mac =stdout.decode()
 			if mac:
 				with self.lock:
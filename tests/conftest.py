@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Test setup for NET Guard.
+
+The modules live in the repository root. wx is replaced by a minimal stand-in when it is not installed, so the scanner can be tested without a display.
+"""
+
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+
+
+class WxStub:
+	"""Stands for any wx class, constant or object: it accepts every call and attribute."""
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def __call__(self, *args, **kwargs):
+		return WxStub()
+
+	def __getattr__(self, name):
+		return WxStub()
+
+	def __bool__(self):
+		return False
+
+	def __or__(self, other):
+		return self
+
+	__ror__ = __or__
+
+
+def installWxStub():
+	wx = types.ModuleType("wx")
+	# Anything not defined here is a WxStub, which is enough to build the frame without a display
+	wx.__getattr__ = lambda name: WxStub()
+	for name in ("Frame", "Dialog", "ListCtrl", "Panel"):
+		setattr(wx, name, type(name, (WxStub,), {}))
+	wx.PostEvent = lambda handler, event: handler.append(event) if isinstance(handler, list) else None
+	# As wx.App, runs OnInit when created
+	wx.App = type("App", (WxStub,), {"__init__": lambda self, *args, **kwargs: self.OnInit()})
+	lib = types.ModuleType("wx.lib")
+	newevent = types.ModuleType("wx.lib.newevent")
+	def NewEvent():
+		class Event:
+			def __init__(self, **kwargs):
+				self.__dict__.update(kwargs)
+		return Event, object()
+	newevent.NewEvent = NewEvent
+	adv = types.ModuleType("wx.adv")
+	adv.__getattr__ = lambda name: WxStub()
+	adv.TaskBarIcon = type("TaskBarIcon", (WxStub,), {})
+	wx.lib = lib
+	wx.adv = adv
+	lib.newevent = newevent
+	sys.modules.update({"wx": wx, "wx.lib": lib, "wx.lib.newevent": newevent, "wx.adv": adv})
+
+
+try:
+	import wx
+except ImportError:
+	installWxStub()
@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import threading
+import urllib.error
+import urllib.request
+from time import sleep
+
+import pytest
+
+from api import APIServer
+from journal import EVENT_UNKNOWN_DEVICE
+from scanner import LANScanner
+
+
+def scan(scanner, table):
+	scanner.startCycle()
+	with scanner.lock:
+		for ip, mac in table.items():
+			scanner.update(ip, mac)
+	scanner.finishCycle()
+
+
+@pytest.fixture
+def api():
+	scanner = LANScanner(devices="")
+	scan(scanner, {"10.0.0.1": "aa:aa:aa:aa:aa:01", "10.0.0.2": "aa:aa:aa:aa:aa:02"})
+	server = APIServer(scanner, port=0)
+	server.start()
+	yield server
+	server.kill()
+
+
+def get(api, path, headers={}):
+	"""Returns (status, headers, JSON body)."""
+	url = "http://127.0.0.1:{}{}".format(api.httpd.server_address[1], path)
+	try:
+		with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=5) as response:
+			body = response.read()
+			return response.status, response.headers, json.loads(body) if body else None
+	except urllib.error.HTTPError as e:
+		body = e.read()
+		return e.code, e.headers, json.loads(body) if body else None
+
+
+def test_devices_since(api):
+	status, headers, body = get(api, "/devices")
+	assert status == 200
+	assert sorted(body["devices"]) == ["aa:aa:aa:aa:aa:01", "aa:aa:aa:aa:aa:02"]
+	version = body["version"]
+	assert headers["ETag"] == '"{}"'.format(version)
+	api.scanner.updateDevices("aa:aa:aa:aa:aa:01", name="router")
+	status, headers, body = get(api, "/devices?since={}".format(version))
+	assert list(body["devices"]) == ["aa:aa:aa:aa:aa:01"]
+	assert body["devices"]["aa:aa:aa:aa:aa:01"]["name"] == "router"
+	assert body["removed"] == []
+
+
+def test_since_below_the_floor_returns_everything(api):
+	version = api.scanner.journal.version
+	api.scanner.journal.reset()
+	status, headers, body = get(api, "/devices?since={}".format(version))
+	assert "since" not in body
+	assert len(body["devices"]) == 2
+
+
+def test_not_modified(api):
+	status, headers, body = get(api, "/devices")
+	status, headers, body = get(api, "/devices", {"If-None-Match": headers["ETag"]})
+	assert status == 304
+	# Events do not change the state version
+	api.scanner.journal.notify(EVENT_UNKNOWN_DEVICE, mac="aa:aa:aa:aa:aa:09")
+	status, headers, body = get(api, "/online", {"If-None-Match": headers["ETag"]})
+	assert status == 304
+
+
+def test_online_during_a_scan(api):
+	status, headers, body = get(api, "/online")
+	version = body["version"]
+	scanner = api.scanner
+	scanner.startCycle()
+	with scanner.lock:
+		scanner.update("10.0.0.3", "aa:aa:aa:aa:aa:03")
+	# The previous cycle is served until this one finishes
+	status, headers, body = get(api, "/online?since={}".format(version))
+	assert body["online"] == [] and body["removed"] == []
+	with scanner.lock:
+		scanner.update("10.0.0.1", "aa:aa:aa:aa:aa:01")
+	scanner.finishCycle()
+	status, headers, body = get(api, "/online?since={}".format(version))
+	assert [d["ip"] for d in body["online"]] == ["10.0.0.3"]
+	assert body["removed"] == ["10.0.0.2"]
+
+
+def test_events_wait(api):
+	version = api.scanner.journal.eventVersion
+	def notify():
+		sleep(0.2)
+		api.scanner.journal.notify(EVENT_UNKNOWN_DEVICE, mac="aa:aa:aa:aa:aa:09")
+	threading.Thread(target=notify).start()
+	status, headers, body = get(api, "/events?since={}&wait=5".format(version))
+	assert [e["type"] for e in body["events"]] == [EVENT_UNKNOWN_DEVICE]
+	assert body["version"] == version+1
+
+
+def test_device_details(api):
+	status, headers, body = get(api, "/devices/aa:aa:aa:aa:aa:02")
+	assert status == 200
+	assert body["ip"] == "10.0.0.2"
+	assert get(api, "/devices/aa:aa:aa:aa:aa:99")[0] == 404
@@ -0,0 +1,47 @@
+# -*- coding: UTF-8 -*-
+
+from bindings import (ALERT_GATEWAY_CHANGED, ALERT_IP_CONFLICT,
+                      ALERT_MAC_FLAPPING, BindingIndex)
+
+
+def alertTypes(alerts):
+	return [alert for alert, details in alerts]
+
+
+def test_conflict_in_the_same_cycle():
+	b = BindingIndex()
+	b.observe("10.0.0.5", "aa", 1)
+	assert alertTypes(b.observe("10.0.0.5", "bb", 2)) == [ALERT_IP_CONFLICT]
+
+
+def test_conflict_across_cycles():
+	# Each IP is probed once per cycle, so the second claim comes in the next one
+	b = BindingIndex(conflictWindow=600)
+	assert b.observe("10.0.0.5", "aa", 0) == []
+	b.newCycle()
+	alerts = b.observe("10.0.0.5", "bb", 300)
+	assert alertTypes(alerts) == [ALERT_IP_CONFLICT]
+	assert alerts[0][1]["macs"] == ["aa", "bb"]
+
+
+def test_no_conflict_when_the_owner_moved_or_left():
+	b = BindingIndex(conflictWindow=600)
+	b.observe("10.0.0.5", "aa", 0)
+	b.observe("10.0.0.6", "aa", 100)
+	b.newCycle()
+	assert b.observe("10.0.0.5", "bb", 200) == []
+	b.newCycle()
+	# bb has not been seen for longer than the window, so the IP is free
+	assert b.observe("10.0.0.5", "cc", 2000) == []
+
+
+def test_flapping_and_gateway():
+	b = BindingIndex(gateway="10.0.0.1", flapCount=2)
+	b.observe("10.0.0.1", "gw", 0)
+	b.observe("10.0.0.5", "aa", 0)
+	b.newCycle()
+	assert alertTypes(b.observe("10.0.0.6", "aa", 10)) == []
+	b.newCycle()
+	assert ALERT_MAC_FLAPPING in alertTypes(b.observe("10.0.0.5", "aa", 20))
+	b.newCycle()
+	assert ALERT_GATEWAY_CHANGED in alertTypes(b.observe("10.0.0.1", "evil", 30))
@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+
+import socket
+from time import sleep, time
+
+import pytest
+
+from collector import (FRAME_HEADER, MAX_FRAME, Collector, CollectorClient,
+                       createSocket, decodeFrame, encodeFrame, readFrame)
+from journal import CHANGE_DEVICE
+from registry import DAY
+from scanner import LANScanner
+
+
+def waitFor(condition, timeout=5.0):
+	end = time()+timeout
+	while not condition() and time() < end:
+		sleep(0.02)
+	return condition()
+
+
+@pytest.fixture
+def collector():
+	collector = Collector("127.0.0.1:0", maxDevicesPerSite=50)
+	collector.start()
+	yield collector
+	collector.kill()
+	collector.join(5.0)
+
+
+def connect(collector, site):
+	sock = createSocket(collector.address)
+	sock.settimeout(5)
+	sock.sendall(encodeFrame({"type": "hello", "site": site}))
+	return sock, readFrame(sock)
+
+
+def batch(sock, site, seq, devices, last=True, full=False):
+	sock.sendall(encodeFrame({"type": "batch", "site": site, "seq": seq, "devices": devices, "last": last, "full": full, "online": []}))
+	return readFrame(sock)
+
+
+def scan(scanner, macs):
+	scanner.startCycle()
+	with scanner.lock:
+		for n, mac in enumerate(macs):
+			scanner.update("10.0.0.{}".format(n+1), mac)
+	scanner.finishCycle()
+
+
+def test_frames():
+	small = {"type": "hello", "site": "a"}
+	large = {"devices": {"aa:aa:aa:aa:aa:{:02x}".format(n): ["", 0, 0, 0] for n in range(100)}}
+	for message in (small, large):
+		frame = encodeFrame(message)
+		length, flags = FRAME_HEADER.unpack_from(frame)
+		assert length == len(frame)-FRAME_HEADER.size
+		assert decodeFrame(flags, frame[FRAME_HEADER.size:]) == message
+	assert FRAME_HEADER.unpack_from(encodeFrame(large))[1] == 1
+	a, b = socket.socketpair()
+	a.sendall(FRAME_HEADER.pack(MAX_FRAME+1, 0))
+	with pytest.raises(ValueError):
+		readFrame(b)
+
+
+@pytest.mark.parametrize("data", [FRAME_HEADER.pack(MAX_FRAME+1, 0), FRAME_HEADER.pack(3, 1)+b"bad", FRAME_HEADER.pack(2, 0)+b"{}"])
+def test_malformed_frames_disconnect(collector, data):
+	sock = createSocket(collector.address)
+	sock.settimeout(5)
+	sock.sendall(data)
+	assert sock.recv(1) == b""
+
+
+def test_old_batches_are_acknowledged_but_not_applied(collector):
+	sock, ack = connect(collector, "site")
+	assert ack["seq"] == [0, 0, 0]
+	assert batch(sock, "site", [1, 5, 0], {"aa:aa:aa:aa:aa:01": ["new", 2, 0, 0]})["seq"] == [1, 5, 0]
+	assert batch(sock, "site", [1, 3, 0], {"aa:aa:aa:aa:aa:01": ["old", 2, 0, 0]})["seq"] == [1, 3, 0]
+	assert collector.devices[("site", "aa:aa:aa:aa:aa:01")][0] == "new"
+	# Parts of one batch are applied in order, a replayed part is not applied again
+	batch(sock, "site", [1, 6, 0], {"aa:aa:aa:aa:aa:02": ["two", 2, 0, 0]}, last=False)
+	batch(sock, "site", [1, 6, 1], {"aa:aa:aa:aa:aa:02": ["three", 2, 0, 0]})
+	batch(sock, "site", [1, 6, 0], {"aa:aa:aa:aa:aa:02": ["two", 2, 0, 0]}, last=False)
+	assert collector.devices[("site", "aa:aa:aa:aa:aa:02")][0] == "three"
+	sock.close()
+
+
+def test_memory_is_bounded(collector):
+	sock, ack = connect(collector, "big")
+	batch(sock, "big", [1, 1, 0], {"aa:aa:aa:aa:{:02x}:{:02x}".format(n//256, n%256): ["", 0, 0, 0] for n in range(60)})
+	assert collector.sites["big"]["devices"] == 50
+	assert collector.sites["big"]["dropped"] == 10
+	sock.close()
+	assert waitFor(lambda: not collector.sites["big"]["connected"])
+	collector.expire(time()+collector.siteExpiry+1)
+	assert "big" not in collector.sites
+	assert not collector.devices
+
+
+def test_several_nodes_with_multipart_batches(collector, tmp_path):
+	scanners = []
+	for n in range(3):
+		scanner = LANScanner(devices=str(tmp_path/"devices{}.json".format(n)), archiveAfter=DAY)
+		CollectorClient(scanner, collector.address, site="site{}".format(n), batchSize=2, retry=0.1).start()
+		scanners.append(scanner)
+		scan(scanner, ["02:00:00:00:{:02x}:{:02x}".format(n, d) for d in range(5)])
+	assert waitFor(lambda: len(collector.devices) == 15)
+	assert all(site["online"] == 5 for site in collector.sites.values())
+	# An archived device reaches the collector as a tombstone
+	scanner = scanners[0]
+	scanner.updateDevices("02:00:00:00:00:09", name="old", last=1)
+	scan(scanner, [])
+	assert waitFor(lambda: len(collector.devices) == 16)
+	# As finishCycle does once a day
+	devices = scanner.devices
+	with scanner.lock:
+		for mac in devices.archive(force=True):
+			scanner.journal.record(CHANGE_DEVICE, mac)
+	scan(scanner, [])
+	assert waitFor(lambda: ("site0", "02:00:00:00:00:09") not in collector.devices and len(collector.devices) == 15)
+
+
+def test_reconnects_and_resends(tmp_path):
+	first = Collector("127.0.0.1:0")
+	first.start()
+	address = first.address
+	scanner = LANScanner(devices="")
+	client = CollectorClient(scanner, address, site="site", retry=0.1)
+	client.start()
+	scan(scanner, ["02:00:00:00:00:01", "02:00:00:00:00:02"])
+	assert waitFor(lambda: len(first.devices) == 2)
+	first.kill()
+	first.join(5.0)
+	# A new collector knows nothing, so the client sends everything again
+	second = Collector(address)
+	second.start()
+	scan(scanner, ["02:00:00:00:00:01"])
+	assert waitFor(lambda: len(second.devices) == 2)
+	second.kill()
+	second.join(5.0)
+
+
+def test_malformed_ack_does_not_kill_the_client():
+	server = createSocket("127.0.0.1:0", listen=True)
+	server.settimeout(5)
+	scanner = LANScanner(devices="")
+	client = CollectorClient(scanner, "127.0.0.1:{}".format(server.getsockname()[1]), site="site", retry=0.1)
+	client.start()
+	scan(scanner, ["02:00:00:00:00:01"])
+	for ack in ({"type": "nack"}, [1, 2]):
+		sock, address = server.accept()
+		readFrame(sock)
+		sock.sendall(encodeFrame(ack))
+		sock.close()
+	# The client keeps retrying with a new connection
+	sock, address = server.accept()
+	assert readFrame(sock)["type"] == "hello"
+	assert client.is_alive()
+	sock.close()
+	server.close()
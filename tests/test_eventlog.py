@@ -0,0 +1,29 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import socket
+
+import pytest
+
+import eventlog
+from eventlog import EventLog
+
+
+def test_writes_ndjson(tmp_path):
+	path = str(tmp_path/"events.ndjson")
+	log = EventLog(path, flushInterval=0.05)
+	log.start()
+	for i in range(10):
+		log.put({"type": "deviceFound", "n": i})
+	log.kill()
+	log.join(5.0)
+	with open(path) as f:
+		assert [json.loads(line)["n"] for line in f] == list(range(10))
+	assert log.written == 10 and log.dropped == 0
+
+
+def test_unix_socket_without_af_unix(monkeypatch):
+	# Windows builds have no AF_UNIX; the error must surface instead of killing the writer thread
+	monkeypatch.delattr(eventlog.socket, "AF_UNIX", raising=False)
+	with pytest.raises(ValueError):
+		EventLog("unix:/tmp/netguard.sock")
@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+
+import pytest
+
+from hooks import (CIRCUIT_CLOSED, CIRCUIT_OPEN, DEFAULT_EVENTS, HOOK_PYTHON,
+                   HOOK_SCRIPT, HOOK_WEBHOOK, CallPool, Hook, HookDispatcher)
+from journal import EVENT_MAC_FLAPPING, EVENT_UNKNOWN_DEVICE
+
+
+def waitFor(condition, timeout=5.0):
+	end = time()+timeout
+	while not condition() and time() < end:
+		sleep(0.02)
+	return condition()
+
+
+@pytest.fixture
+def webhook():
+	"""Local HTTP stand-in. Answers with the statuses queued in server.statuses, then with server.status."""
+	class Handler(BaseHTTPRequestHandler):
+		def do_POST(self):
+			body = self.rfile.read(int(self.headers["Content-Length"]))
+			server.requests.append(json.loads(body))
+			self.send_response(server.statuses.pop(0) if server.statuses else server.status)
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+	server.requests = []
+	server.statuses = []
+	server.status = 200
+	server.url = "http://127.0.0.1:{}/alert".format(server.server_address[1])
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+
+def event(n=0):
+	return {"type": EVENT_UNKNOWN_DEVICE, "data": {"mac": n}}
+
+
+def test_default_events_include_mac_flapping():
+	assert EVENT_MAC_FLAPPING in DEFAULT_EVENTS
+
+
+def test_timed_out_calls_are_bounded():
+	release = threading.Event()
+	pool = CallPool(size=1)
+	threads = threading.active_count()
+	with pytest.raises(TimeoutError):
+		pool.call(lambda events: release.wait(), [], 0.05)
+	# The abandoned call still holds the only slot
+	start = time()
+	with pytest.raises(TimeoutError):
+		pool.call(lambda events: None, [], 5.0)
+	assert time()-start < 1.0
+	assert threading.active_count() == threads
+	release.set()
+	sleep(0.1)
+	assert pool.call(lambda events: len(events), [1, 2], 1.0) == 2
+
+
+def test_python_hook_errors_are_raised():
+	def fail(events):
+		raise ValueError("broken")
+	with pytest.raises(ValueError):
+		Hook(HOOK_PYTHON, fail).call([], CallPool(size=1))
+
+
+def test_script_hook_reads_events(tmp_path):
+	out = tmp_path/"events.json"
+	code = "import sys; open(sys.argv[1], 'w').write(sys.stdin.read())"
+	Hook(HOOK_SCRIPT, [sys.executable, "-c", code, str(out)]).call([{"type": EVENT_UNKNOWN_DEVICE}])
+	assert EVENT_UNKNOWN_DEVICE in out.read_text()
+
+
+def test_dispatcher_batches_events():
+	calls = []
+	dispatcher = HookDispatcher([Hook(HOOK_PYTHON, lambda events: calls.append(len(events)), batchDelay=0.1)])
+	dispatcher.start()
+	for n in range(3):
+		dispatcher.put({"type": EVENT_UNKNOWN_DEVICE, "data": {"mac": n}})
+	for n in range(50):
+		if calls: break
+		sleep(0.05)
+	dispatcher.kill()
+	assert calls == [3]
+
+
+def test_webhook_posts_events(webhook):
+	Hook(HOOK_WEBHOOK, webhook.url).call([event(1)])
+	assert webhook.requests == [{"events": [event(1)]}]
+	webhook.status = 500
+	with pytest.raises(OSError):
+		Hook(HOOK_WEBHOOK, webhook.url).call([event(2)])
+
+
+def test_webhook_retries_server_errors(webhook):
+	webhook.statuses = [500, 500]
+	hook = Hook(HOOK_WEBHOOK, webhook.url, retries=2, batchDelay=0.05)
+	dispatcher = HookDispatcher([hook], retryDelay=0.01)
+	dispatcher.start()
+	dispatcher.put(event())
+	assert waitFor(lambda: hook.sent == 1)
+	dispatcher.kill()
+	assert len(webhook.requests) == 3
+	assert hook.failed == 0
+	assert hook.circuit == CIRCUIT_CLOSED
+
+
+def test_webhook_circuit_opens_and_recovers(webhook):
+	webhook.status = 500
+	hook = Hook(HOOK_WEBHOOK, webhook.url, retries=0, batch=1, batchDelay=0.01, failureThreshold=2, cooldown=0.3)
+	dispatcher = HookDispatcher([hook], retryDelay=0.01)
+	dispatcher.start()
+	dispatcher.put(event(1))
+	dispatcher.put(event(2))
+	assert waitFor(lambda: hook.failed == 2)
+	assert hook.circuit == CIRCUIT_OPEN
+	# While open the target is not called
+	dispatcher.put(event(3))
+	assert waitFor(lambda: hook.skipped == 1)
+	assert len(webhook.requests) == 2
+	# After the cooldown a single half-open call tests the target again and closes the circuit
+	webhook.status = 200
+	sleep(0.3)
+	dispatcher.put(event(4))
+	assert waitFor(lambda: hook.sent == 1)
+	dispatcher.kill()
+	assert hook.circuit == CIRCUIT_CLOSED
+	assert hook.failures == 0
+	assert webhook.requests[-1] == {"events": [event(4)]}
@@ -0,0 +1,40 @@
+# -*- coding: UTF-8 -*-
+
+from journal import CHANGE_DEVICE, CHANGE_ONLINE, EVENT_DEVICE_FOUND, ChangeJournal
+
+
+def test_changes_since():
+	journal = ChangeJournal()
+	v = journal.record(CHANGE_DEVICE, "a")
+	journal.record(CHANGE_ONLINE, "10.0.0.1")
+	journal.record(CHANGE_DEVICE, "b")
+	journal.record(CHANGE_DEVICE, "a")
+	assert sorted(journal.changesSince(v, CHANGE_DEVICE)) == ["a", "b"]
+	assert journal.changesSince(journal.version) == []
+
+
+def test_forgotten_versions():
+	journal = ChangeJournal(maxChanges=2)
+	for key in "abc":
+		journal.record(CHANGE_DEVICE, key)
+	assert journal.changesSince(0) is None
+	assert journal.changesSince(journal.version-1) == ["c"]
+	version = journal.reset()
+	assert journal.changesSince(version-1) is None
+	assert journal.changesSince(version) == []
+
+
+def test_events_have_their_own_versions():
+	journal = ChangeJournal(maxEvents=2)
+	received = []
+	journal.subscribe(received.append)
+	version = journal.version
+	for n in range(3):
+		journal.notify(EVENT_DEVICE_FOUND, n=n)
+	assert journal.version == version
+	assert journal.eventVersion == 3
+	assert [e["data"]["n"] for e in journal.eventsSince(0)] == [1, 2]
+	assert journal.waitEvents(3, timeout=0.01) == []
+	journal.unsubscribe(received.append)
+	journal.notify(EVENT_DEVICE_FOUND, n=3)
+	assert len(received) == 3
@@ -0,0 +1,77 @@
+# -*- coding: UTF-8 -*-
+
+from presence import DAY, HOUR, PresenceHistory, decode, encode
+
+
+def history(tmp_path=None, **kwargs):
+	return PresenceHistory(str(tmp_path/"presence.json") if tmp_path else "", **kwargs)
+
+
+def test_sightings_within_the_gap_are_merged():
+	h = history()
+	for t in (1000, 1100, 1200, 5000, 5100):
+		h.record("aa", t, gap=360)
+	assert h.intervals("aa") == [(1000, 1200), (5000, 5100)]
+	# Late sightings do not move the end back
+	h.record("aa", 5050, gap=360)
+	assert h.intervals("aa") == [(1000, 1200), (5000, 5100)]
+
+
+def test_uptime_is_clipped_to_the_range():
+	h = history()
+	h.record("aa", 1000, gap=0)
+	h.record("aa", 2000, gap=1000)
+	h.record("aa", 5000, gap=0)
+	h.record("aa", 6000, gap=1000)
+	assert h.uptime("aa", 0, 10000) == 2000
+	assert h.uptime("aa", 1500, 5500) == 1000
+	assert h.uptime("aa", 2500, 4500) == 0
+	assert h.uptime("bb", 0, 10000) == 0
+
+
+def test_online_between_uses_the_days():
+	h = history()
+	h.record("aa", DAY+10, gap=0)
+	h.record("aa", 3*DAY+10, gap=3*DAY)
+	h.record("bb", 5*DAY, gap=0)
+	# aa was online through day 2 without a sighting on it
+	assert h.onlineBetween(2*DAY, 2*DAY+HOUR) == {"aa"}
+	assert h.onlineBetween(4*DAY, 6*DAY) == {"bb"}
+	assert h.onlineBetween(7*DAY, 8*DAY) == set()
+
+
+def test_compact_discards_and_downsamples():
+	h = history(retention=10*DAY, fineTime=2*DAY, coarseGap=HOUR)
+	h.record("old", 0, gap=0)
+	for t in (5*DAY, 5*DAY+600, 5*DAY+7200, 9*DAY, 9*DAY+600):
+		h.record("aa", t, gap=0)
+	h.compact(now=10*DAY+1, force=True)
+	assert "old" not in h
+	# Intervals older than fineTime separated by less than coarseGap are merged, recent ones are kept
+	assert h.intervals("aa") == [(5*DAY, 5*DAY+600), (5*DAY+7200, 5*DAY+7200), (9*DAY, 9*DAY), (9*DAY+600, 9*DAY+600)]
+	h2 = history(retention=10*DAY, fineTime=DAY, coarseGap=2*HOUR)
+	for t in (5*DAY, 5*DAY+600, 5*DAY+7200):
+		h2.record("aa", t, gap=0)
+	h2.compact(now=10*DAY, force=True)
+	assert h2.intervals("aa") == [(5*DAY, 5*DAY+7200)]
+	assert h2.onlineBetween(0, 1) == set()
+
+
+def test_encode_decode_round_trip():
+	starts, ends = [100, 500, 900], [200, 500, 1500]
+	assert encode(starts, ends) == [100, 100, 300, 0, 400, 600]
+	assert decode(encode(starts, ends)) == (starts, ends)
+
+
+def test_save_and_load(tmp_path):
+	h = history(tmp_path)
+	h.record("aa", DAY+10, gap=0)
+	h.record("aa", DAY+20, gap=60)
+	snapshot = h.snapshot()
+	h.record("bb", DAY+30, gap=0)
+	# A snapshot taken under the lock is written later as it was
+	assert h.save(snapshot)
+	loaded = history(tmp_path)
+	assert loaded.intervals("aa") == [(DAY+10, DAY+20)]
+	assert "bb" not in loaded
+	assert loaded.onlineBetween(DAY, DAY+100) == {"aa"}
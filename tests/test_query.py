@@ -0,0 +1,34 @@
+# -*- coding: UTF-8 -*-
+
+from query import SORT_MAC, SORT_NAME, DeviceIndex
+from scanner import LANScanner
+
+
+def indexedScanner():
+	scanner = LANScanner(devices="")
+	for n, name in enumerate(("printer", "phone", "host-1", "host-2")):
+		scanner.updateDevices("aa:aa:aa:aa:aa:0{}".format(n), name=name, last=1)
+	index = DeviceIndex(scanner)
+	return scanner, index
+
+
+def test_search_and_sort():
+	scanner, index = indexedScanner()
+	assert index.stale
+	index.refresh()
+	assert not index.stale
+	assert index.search("hos", ((SORT_NAME, True),)) == ["aa:aa:aa:aa:aa:03", "aa:aa:aa:aa:aa:02"]
+	assert index.search("host-2") == ["aa:aa:aa:aa:aa:03"]
+	assert index.search("aaaaaaaaaa00") == ["aa:aa:aa:aa:aa:00"]
+	assert index.search("p", ((SORT_MAC, False),)) == ["aa:aa:aa:aa:aa:00", "aa:aa:aa:aa:aa:01"]
+	assert index.search("hos", macs=["aa:aa:aa:aa:aa:02"]) == ["aa:aa:aa:aa:aa:02"]
+
+
+def test_refresh_is_incremental():
+	scanner, index = indexedScanner()
+	index.refresh()
+	scanner.updateDevices("aa:aa:aa:aa:aa:01", name="tablet")
+	assert not index.stale
+	index.refresh()
+	assert index.search("tab") == ["aa:aa:aa:aa:aa:01"]
+	assert index.search("phone") == []
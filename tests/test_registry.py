@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+
+import json
+
+from journal import CHANGE_DEVICE
+from query import DeviceIndex
+from registry import DAY, DeviceRegistry
+from scanner import LANScanner
+
+
+def test_archive_and_restore(tmp_path):
+	registry = DeviceRegistry(str(tmp_path/"devices.json"), archiveAfter=10*DAY)
+	registry["aa:aa:aa:aa:aa:01"] = ("old", 2, 0, 0)
+	registry["aa:aa:aa:aa:aa:02"] = ("new", 2, 0, 20*DAY)
+	registry["aa:aa:aa:aa:aa:03"] = ("older", 1, 0, 0)
+	assert registry.archive(now=20*DAY) == ["aa:aa:aa:aa:aa:01", "aa:aa:aa:aa:aa:03"]
+	assert "aa:aa:aa:aa:aa:01" not in registry
+	assert registry.archived == 2
+	assert registry.restore("aa:aa:aa:aa:aa:03")
+	assert tuple(registry["aa:aa:aa:aa:aa:03"]) == ("older", 1, 0, 0)
+	assert registry.archived == 1
+	assert list(registry.readArchive()) == ["aa:aa:aa:aa:aa:01"]
+	# The file keeps the restored device until the devices file has been saved
+	assert "aa:aa:aa:aa:aa:03" in (tmp_path/"devices.archive.json").read_text()
+	registry.save()
+	registry.compactArchive()
+	assert "aa:aa:aa:aa:aa:03" not in (tmp_path/"devices.archive.json").read_text()
+	assert registry.restore("aa:aa:aa:aa:aa:01")
+	assert not registry.isArchived("aa:aa:aa:aa:aa:04")
+
+
+def test_restore_after_reload(tmp_path):
+	registry = DeviceRegistry(str(tmp_path/"devices.json"), archiveAfter=10*DAY)
+	for n in range(10):
+		registry["aa:aa:aa:aa:aa:{:02x}".format(n)] = ("device {}".format(n), 2, 0, 0)
+	registry.archive(now=20*DAY)
+	registry.save()
+	reloaded = DeviceRegistry(str(tmp_path/"devices.json"), archiveAfter=10*DAY)
+	assert reloaded.archived == 10
+	assert reloaded.restore("aa:aa:aa:aa:aa:07")
+	assert reloaded["aa:aa:aa:aa:aa:07"].name == "device 7"
+
+
+def test_archive_of_earlier_versions_is_converted(tmp_path):
+	(tmp_path/"devices.archive.json").write_text(json.dumps({"aa:aa:aa:aa:aa:01": ["old", 2, 0, 0]}))
+	registry = DeviceRegistry(str(tmp_path/"devices.json"))
+	assert registry.archived == 1
+	assert registry.restore("aa:aa:aa:aa:aa:01")
+	assert registry["aa:aa:aa:aa:aa:01"].name == "old"
+
+
+def test_archived_devices_are_recorded_in_the_journal(tmp_path):
+	scanner = LANScanner(devices=str(tmp_path/"devices.json"), archiveAfter=DAY)
+	scanner.updateDevices("aa:aa:aa:aa:aa:01", name="old", last=1)
+	index = DeviceIndex(scanner)
+	index.refresh()
+	assert index.search("old") == ["aa:aa:aa:aa:aa:01"]
+	version = scanner.journal.version
+	scanner.startCycle()
+	scanner.finishCycle()
+	assert "aa:aa:aa:aa:aa:01" in scanner.journal.changesSince(version, CHANGE_DEVICE)
+	index.refresh()
+	assert index.search("old") == []
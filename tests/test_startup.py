@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+from scanner import LANScanner
+
+# Seconds allowed for "import main" plus OnInit with --hidden, with wx stubbed; it takes about 60 ms here
+STARTUP_BUDGET = 1.0
+DEFERRED_MODULES = ("api", "collector", "eventlog", "hooks", "pyperclip", "winsound")
+
+MEASURE = """
+import os, sys, time
+sys.path[:0] = [{tests!r}, {root!r}]
+sys.argv = [os.path.join(os.getcwd(), "main.py"), "--hidden"]
+import conftest
+conftest.installWxStub()
+start = time.perf_counter()
+import main
+import scanner
+order = []
+# Scanning needs getmacaddress.exe on Windows, here the thread only reads its files
+scanner.LANScanner.run = lambda self: self.load()
+bind, startThread = scanner.LANScanner.bind, scanner.LANScanner.start
+scanner.LANScanner.bind = lambda self, handler: (order.append("bind"), bind(self, handler))
+scanner.LANScanner.start = lambda self: (order.append("start"), startThread(self))
+app = main.netScannerApp(0)
+print(time.perf_counter() - start)
+print(" ".join(m for m in {deferred!r} if m in sys.modules))
+print(" ".join(order), app.frame.WidgetsBuilt)
+"""
+
+
+def test_startup_time_budget(tmp_path):
+	(tmp_path/"getmacaddress.exe").write_bytes(b"")
+	code = MEASURE.format(tests=os.path.join(ROOT, "tests"), root=ROOT, deferred=DEFERRED_MODULES)
+	env = dict(os.environ, LANG="en_US.UTF-8")
+	# A fresh interpreter, so nothing is imported already
+	output = subprocess.run([sys.executable, "-B", "-c", code], cwd=tmp_path, env=env, capture_output=True, text=True, check=True).stdout.split("\n")
+	assert float(output[0]) < STARTUP_BUDGET
+	assert output[1] == ""
+	# The window is bound to the scanner before it starts, and its widgets wait for the first restore
+	assert output[2] == "bind start False"
+
+
+def test_scanner_reads_files_in_its_thread(tmp_path):
+	devices = tmp_path/"devices.json"
+	devices.write_text(json.dumps({"aa:aa:aa:aa:aa:01": ["router", 2, 0, 0]}))
+	scanner = LANScanner(devices=str(devices))
+	assert len(scanner.devices) == 0
+	version = scanner.journal.version
+	scanner.load()
+	assert "aa:aa:aa:aa:aa:01" in scanner.devices
+	assert scanner.journal.changesSince(version) is None
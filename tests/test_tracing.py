@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+
+import json
+from threading import Event, current_thread
+from time import sleep, time
+
+from tracing import Tracer
+
+
+def waitFor(condition, timeout=5.0):
+	while not condition() and timeout > 0:
+		sleep(0.01)
+		timeout -= 0.01
+	return condition()
+
+
+def readTrace(path):
+	# None until the writer thread has finished the file
+	try:
+		return json.loads(path.read_text())
+	except (OSError, ValueError):
+		return None
+
+
+def test_toggle_writes_the_trace(tmp_path):
+	tracer = Tracer()
+	tracer.path = str(tmp_path/"trace.json")
+	tracer.toggle()
+	assert waitFor(lambda: tracer.enabled)
+	with tracer.span("work"):
+		pass
+	tracer.toggle()
+	assert waitFor(lambda: readTrace(tmp_path/"trace.json"))
+	events = readTrace(tmp_path/"trace.json")["traceEvents"]
+	assert [e["name"] for e in events if e["ph"] == "X"] == ["work"]
+
+
+def test_toggle_does_not_stop_in_the_calling_thread(tmp_path):
+	# A signal handler may interrupt a thread inside add() that holds the tracer lock, stopping there would deadlock
+	release = Event()
+	stoppers = []
+	class SlowTracer(Tracer):
+		def stop(self):
+			stoppers.append(current_thread())
+			release.wait(5.0)
+			return Tracer.stop(self)
+	tracer = SlowTracer()
+	tracer.start(str(tmp_path/"trace.json"))
+	start = time()
+	tracer.toggle()
+	assert time()-start < 0.5
+	assert waitFor(lambda: stoppers)
+	assert stoppers[0] is not current_thread()
+	release.set()
+	assert waitFor(lambda: not tracer.enabled)
+	assert waitFor(lambda: readTrace(tmp_path/"trace.json"))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Tracing for NET Guard application.
+
+Records spans around the scan cycle, the address resolutions, the registry updates and the GUI refresh, plus the time spent waiting for the scanner lock.
+The trace is written in Chrome trace event format; open it in chrome://tracing or https://ui.perfetto.dev
+Optionally a sampling profiler records what every thread is running.
+
+Tracing costs a single flag check while it is off. It can be switched on and off at runtime with tracer.toggle(), from the Tracing item of the File menu or, where the console allows it, with Ctrl+Break (SIGBREAK) or SIGUSR1.
+
+https://github.com/javidominguez/netGuard
+
+Copyright (C) 2023 Javi Dominguez
+This file is covered by the GNU General Public License.
+See the file COPYING for more details.
+"""
+
+import json
+import os
+import sys
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from threading import Lock, Thread, current_thread, enumerate, get_ident
+from time import perf_counter, sleep
+
+MAX_EVENTS = 1000000
+
+_noSpan = nullcontext()
+
+
+def now():
+	return perf_counter()*1000000
+
+
+class Tracer:
+	def __init__(self):
+		self.enabled = False
+		self.path = "trace.json"
+		self.__lock = Lock()
+		self.__events = []
+		# tid -> thread name, short lived scanning threads are gone when the trace is written
+		self.__threads = {}
+		self.__cycles = None
+		self.__sampler = None
+		self.__pid = os.getpid()
+
+	def start(self, path="trace.json", cycles=None, sampleInterval=None):
+		"""Starts recording. Stops by itself after cycles scan cycles if given. sampleInterval in seconds enables the sampling profiler."""
+		with self.__lock:
+			if self.enabled: return
+			self.path = path
+			self.__events = []
+			self.__cycles = cycles
+			self.enabled = True
+		if sampleInterval:
+			self.__sampler = Sampler(self, sampleInterval)
+			self.__sampler.start()
+
+	def stop(self):
+		"""Stops recording and writes the trace file. Returns its path."""
+		with self.__lock:
+			if not self.enabled: return None
+			self.enabled = False
+		if self.__sampler:
+			self.__sampler.kill()
+			self.__sampler.join()
+			self.__sampler = None
+		with self.__lock:
+			events = self.__events
+			self.__events = []
+		for thread in enumerate():
+			self.__threads.setdefault(thread.ident, thread.name)
+		for tid, name in self.__threads.items():
+			events.append({"name": "thread_name", "ph": "M", "pid": self.__pid, "tid": tid, "args": {"name": name}})
+		with open(self.path, "w") as f:
+			json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+		return self.path
+
+	def toggle(self, *args):
+		"""Starts or stops tracing. Accepts the arguments of a signal handler."""
+		# A signal handler may interrupt a thread that holds the tracer lock, so the work is done apart
+		Thread(target=self.__toggle, name="Trace toggle").start()
+
+	def __toggle(self):
+		if self.enabled:
+			self.stop()
+		else:
+			self.start(self.path)
+
+	def add(self, name, cat, start, end, args=None, tid=None):
+		if tid is None:
+			tid = get_ident()
+			if tid not in self.__threads: self.__threads[tid] = current_thread().name
+		event = {"name": name, "cat": cat, "ph": "X", "ts": start, "dur": end-start, "pid": self.__pid, "tid": tid}
+		if args: event["args"] = args
+		with self.__lock:
+			if len(self.__events) < MAX_EVENTS:
+				self.__events.append(event)
+
+	def span(self, name, cat="netguard", **args):
+		if not self.enabled: return _noSpan
+		return self.__span(name, cat, args)
+
+	@contextmanager
+	def __span(self, name, cat, args):
+		start = now()
+		try:
+			yield
+		finally:
+			self.add(name, cat, start, now(), args)
+
+	def cycleFinished(self):
+		if not self.enabled or self.__cycles is None: return
+		self.__cycles -= 1
+		if self.__cycles <= 0:
+			# Written from a separate thread, so the scanner does not wait for it
+			Thread(target=self.stop, name="Trace writer", daemon=True).start()
+
+
+class Sampler(Thread):
+	"""Samples the stack of every thread and merges consecutive equal samples into spans."""
+
+	def __init__(self, tracer, interval):
+		Thread.__init__(self)
+		self.name = "Trace sampler"
+		self.setDaemon(True)
+		self.tracer = tracer
+		self.interval = interval
+		self.__flagStop = False
+
+	def run(self):
+		# tid -> (frame description, start time)
+		current = {}
+		own = get_ident()
+		while not self.__flagStop:
+			t = now()
+			for tid, frame in sys._current_frames().items():
+				if tid == own: continue
+				name = "{} ({}:{})".format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename), frame.f_lineno)
+				previous = current.get(tid)
+				if previous and previous[0] != name:
+					self.tracer.add(previous[0], "sample", previous[1], t, tid=tid)
+				if not previous or previous[0] != name:
+					current[tid] = (name, t)
+			sleep(self.interval)
+		t = now()
+		for tid, (name, start) in current.items():
+			self.tracer.add(name, "sample", start, t, tid=tid)
+
+	def kill(self):
+		self.__flagStop = True
+
+
+class TracedLock:
+	"""A Lock that records the time spent waiting for it and holding it while tracing is on."""
+
+	def __init__(self, name):
+		self.name = name
+		self.__lock = Lock()
+		self.__acquired = {}
+
+	def acquire(self, blocking=True, timeout=-1):
+		if not tracer.enabled:
+			return self.__lock.acquire(blocking, timeout)
+		start = now()
+		acquired = self.__lock.acquire(blocking, timeout)
+		end = now()
+		tracer.add(self.name+" wait", "lock", start, end)
+		if acquired: self.__acquired[get_ident()] = end
+		return acquired
+
+	def release(self):
+		held = self.__acquired.pop(get_ident(), None)
+		self.__lock.release()
+		if held is not None and tracer.enabled:
+			tracer.add(self.name+" held", "lock", held, now())
+
+	def locked(self):
+		return self.__lock.locked()
+
+	__enter__ = acquire
+
+	def __exit__(self, *args):
+		self.release()
+
+
+def traced(name=None, cat="netguard"):
+	"""Decorator that records a span for every call of the function."""
+	def decorator(function):
+		spanName = name or function.__qualname__
+		@wraps(function)
+		def wrapper(*args, **kwargs):
+			if not tracer.enabled: return function(*args, **kwargs)
+			start = now()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				tracer.add(spanName, cat, start, now())
+		return wrapper
+	return decorator
+
+
+tracer = Tracer()